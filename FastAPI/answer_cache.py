@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class AnswerCache():
+
+    """In-memory semantic cache of query answers.
+       An answer is reused when the embedding of a new query has a cosine similarity with a cached
+       query above `threshold`, and the collection it was answered from has not changed since
+       (same collection version). Entries expire after `ttl_seconds` and the least recently used
+       are evicted beyond `max_entries`.
+
+    Args:
+        threshold (Optional[float], optional): Minimum cosine similarity of a hit. Defaults to ANSWER_CACHE_THRESHOLD or 0.95.
+        ttl_seconds (Optional[float], optional): Lifetime of an entry. Defaults to ANSWER_CACHE_TTL_SECONDS or 3600.
+        max_entries (Optional[int], optional): Entries kept before the least recently used are evicted.
+            Defaults to ANSWER_CACHE_MAX_ENTRIES or 1000.
+
+    """
+
+    def __init__(self, threshold: Optional[float] = None, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.threshold = threshold or float(os.getenv("ANSWER_CACHE_THRESHOLD") or 0.95)
+        self.ttl_seconds = ttl_seconds or float(os.getenv("ANSWER_CACHE_TTL_SECONDS") or 3600)
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_MAX_ENTRIES") or 1000)
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+
+    def get(self, embedding: List[float], collection_name: str, version: int) -> Optional[str]:
+        """
+        Returns the answer of the most similar cached query of the collection version, if similar enough
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if now - entry["created_at"] > self.ttl_seconds:
+                    del self._entries[entry_id]
+                    self._stats["expired"] += 1
+                elif entry["collection_name"] == collection_name and entry["version"] != version:
+                    # Answered from documents that have since been re-indexed or deleted
+                    del self._entries[entry_id]
+                    self._stats["invalidated"] += 1
+                elif entry["collection_name"] == collection_name and len(entry["embedding"]) == len(query):
+                    candidates.append(entry_id)
+
+            if candidates:
+                similarities = np.stack([self._entries[entry_id]["embedding"] for entry_id in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(candidates[best])
+                    self._stats["hits"] += 1
+                    return self._entries[candidates[best]]["answer"]
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, embedding: List[float], answer: str, collection_name: str, version: int):
+        """
+        Caches the answer to a query
+        """
+        with self._lock:
+            self._entries[self._next_id] = {
+                "embedding": self._normalize(embedding),
+                "answer": answer,
+                "collection_name": collection_name,
+                "version": version,
+                "created_at": time.time(),
+            }
+            self._next_id += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters, the hit rate and the number of entries
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["entries"] = len(self._entries)
+            return stats
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Returns the process-wide answer cache, or None if disabled with ANSWER_CACHE_ENABLED=false.
+    The cache outlives query pipeline reloads; entries are scoped by collection and version.
+    """
+    global _shared_cache
+
+    if (os.getenv("ANSWER_CACHE_ENABLED") or "true").lower() == "false":
+        return None
+
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache()
+        return _shared_cache
@@ -0,0 +1,248 @@
+"""Indexes every object under a MinIO bucket prefix, resuming where an interrupted run stopped.
+
+    python bulk_index.py --prefix reports/2024/ --workers 2 --batch-size 32
+
+Objects whose ETag is already recorded in the index manifest are skipped, so running the
+command again after an interruption only indexes what is left. Objects that were being indexed
+when the run stopped have their partial chunks deleted before they are indexed again.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+from minio import Minio
+
+from indexing import Indexing_Pipeline, batched
+from manifest import IndexManifest
+
+
+def list_objects(minio_client: Minio, bucket: str, prefix: str) -> Iterator[tuple]:
+    """
+    Yields the (object_name, etag) of every object under the prefix of the bucket
+    """
+    for obj in minio_client.list_objects(bucket, prefix=prefix, recursive=True):
+        if not obj.is_dir:
+            yield obj.object_name, obj.etag
+
+
+def pending_objects(minio_client: Minio, bucket: str, prefix: str, manifest: IndexManifest, collection_name: str) -> tuple:
+    """
+    Returns the names of the objects under the prefix not yet indexed into the collection with
+    their current ETag, and the number of objects already indexed
+    """
+    indexed = manifest.file_etags(collection_name)
+    pending, skipped = [], 0
+    for object_name, etag in list_objects(minio_client, bucket, prefix):
+        if indexed.get(object_name) == etag:
+            skipped += 1
+        else:
+            pending.append(object_name)
+    return pending, skipped
+
+
+class BulkCheckpoint():
+
+    """SQLite checkpoint of a bulk indexing run: objects started, done or failed per collection.
+
+    Args:
+        db_path (Optional[str], optional): Path to the SQLite database. Defaults to BULK_INDEX_CHECKPOINT_PATH or "./bulk_index.db".
+
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("BULK_INDEX_CHECKPOINT_PATH") or "./bulk_index.db"
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS objects (
+                    collection_name TEXT NOT NULL,
+                    object_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (collection_name, object_name)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def mark(self, collection_name: str, object_names: List[str], status: str, error: Optional[str] = None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                """INSERT INTO objects (collection_name, object_name, status, error, updated_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (collection_name, object_name) DO UPDATE
+                   SET status = excluded.status, error = excluded.error, updated_at = excluded.updated_at""",
+                [(collection_name, object_name, status, error, now) for object_name in object_names],
+            )
+
+    def with_status(self, collection_name: str, status: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT object_name FROM objects WHERE collection_name = ? AND status = ?", (collection_name, status)
+            ).fetchall()
+        return [row["object_name"] for row in rows]
+
+
+class BulkIndexer():
+
+    """Indexes the objects under a bucket prefix in batches run concurrently by `workers` pipelines,
+       checkpointing each object when its indexing finishes.
+
+    Args:
+        workers (Optional[int], optional): Batches indexed concurrently, one pipeline each. Defaults to BULK_INDEX_WORKERS or 2.
+        batch_size (Optional[int], optional): Objects per pipeline run. Defaults to BULK_INDEX_BATCH_SIZE or 32.
+        checkpoint (Optional[BulkCheckpoint], optional): Checkpoint of the run. Defaults to BulkCheckpoint().
+        pipeline_factory (Callable[[], Indexing_Pipeline]): Builds the pipelines. Defaults to Indexing_Pipeline.
+
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_size: Optional[int] = None,
+                 checkpoint: Optional[BulkCheckpoint] = None,
+                 pipeline_factory: Callable[[], Indexing_Pipeline] = Indexing_Pipeline):
+        self.workers = workers or int(os.getenv("BULK_INDEX_WORKERS") or 2)
+        self.batch_size = batch_size or int(os.getenv("BULK_INDEX_BATCH_SIZE") or 32)
+        self.checkpoint = checkpoint or BulkCheckpoint()
+        self.pipeline_factory = pipeline_factory
+        self._local = threading.local()
+        self._pipelines = []
+        self._lock = threading.Lock()
+
+    def pipeline(self) -> Indexing_Pipeline:
+        """
+        Returns the pipeline of the calling worker thread
+        """
+        if not hasattr(self._local, "pipeline"):
+            self._local.pipeline = self.pipeline_factory()
+            with self._lock:
+                self._pipelines.append(self._local.pipeline)
+        return self._local.pipeline
+
+    def run(self, prefix: str) -> dict:
+        """
+        Indexes the objects under the prefix that are not indexed yet
+
+        Returns:
+            dict: Objects listed, skipped, indexed and failed, chunks and embeddings, and docs/s, chunks/s and embeddings/s
+        """
+        pipeline = self.pipeline()
+        collection_name = pipeline.collection_name
+        pending, skipped = pending_objects(pipeline.minio_client, pipeline.minio_bucket, prefix,
+                                           pipeline.manifest, collection_name)
+
+        # Objects being indexed when the last run stopped may have part of their chunks inserted
+        pending_set = set(pending)
+        interrupted = [name for name in self.checkpoint.with_status(collection_name, "started") if name in pending_set]
+        for object_name in interrupted:
+            pipeline.delete_milvus_indexes_using_filename(object_name)
+        print(f"{len(pending) + skipped} objects under '{prefix}': {skipped} already indexed, {len(pending)} to index"
+              + (f", {len(interrupted)} interrupted" if interrupted else ""))
+
+        totals = {"objects": len(pending) + skipped, "skipped": skipped, "indexed": 0, "failed": 0,
+                  "pages": 0, "chunks": 0, "embeddings": 0}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-index") as executor:
+            futures = [executor.submit(self.index_batch, collection_name, batch) for batch in batched(pending, self.batch_size)]
+            for future in as_completed(futures):
+                result = future.result()
+                for key, value in result.items():
+                    totals[key] += value
+                done = totals["indexed"] + totals["failed"]
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(pending)} objects, {totals['failed']} failed, {done / elapsed:.2f} docs/s")
+
+        # Collections are flushed and compacted once, at the end of the job
+        writers = [pipeline.vector_writer for pipeline in self._pipelines if pipeline.vector_writer]
+        for writer in writers:
+            writer.finish(compact=True)
+        writer_stats = [writer.stats() for writer in writers]
+        totals["rows_inserted"] = sum(stats["rows"] for stats in writer_stats)
+        write_seconds = sum(stats["write_seconds"] for stats in writer_stats)
+
+        elapsed = time.perf_counter() - start
+        totals["seconds"] = round(elapsed, 1)
+        totals["docs_per_second"] = round(totals["indexed"] / elapsed, 2) if elapsed else 0.0
+        totals["chunks_per_second"] = round(totals["chunks"] / elapsed, 2) if elapsed else 0.0
+        totals["embeddings_per_second"] = round(totals["embeddings"] / elapsed, 2) if elapsed else 0.0
+        # Throughput of the inserts themselves, excluding the other stages
+        totals["insert_rows_per_second"] = round(totals["rows_inserted"] / write_seconds, 1) if write_seconds else 0.0
+        return totals
+
+    def index_batch(self, collection_name: str, object_names: List[str]) -> dict:
+        """
+        Indexes a batch of objects with the worker's pipeline. If the run fails, the objects it did not
+        finish are indexed one at a time so that one bad object does not fail the others.
+        """
+        pipeline = self.pipeline()
+        embedded_before = pipeline.embedder.stats()["texts"]
+        finished = set()
+        # Objects skipped because their ETag is unchanged are not counted as indexed
+        skipped = set()
+
+        def report_progress(stage: str, **progress):
+            if stage == "upsert" and progress.get("status") in ("done", "skipped"):
+                finished.add(progress["file_name"])
+                if progress["status"] == "skipped":
+                    skipped.add(progress["file_name"])
+                self.checkpoint.mark(collection_name, [progress["file_name"]], "done")
+
+        result = {"indexed": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0}
+        self.checkpoint.mark(collection_name, object_names, "started")
+        try:
+            runs = [pipeline.run(object_names, progress_callback=report_progress, flush=False)]
+        except Exception as e:
+            print(f"Indexing a batch of {len(object_names)} objects failed ({e}), retrying them one at a time")
+            runs = []
+            for object_name in object_names:
+                if object_name in finished:
+                    continue
+                # Chunks of the object inserted or buffered by the failed run are removed before it is indexed again
+                if pipeline.vector_writer:
+                    pipeline.vector_writer.clear()
+                pipeline.delete_milvus_indexes_using_filename(object_name)
+                try:
+                    runs.append(pipeline.run([object_name], progress_callback=report_progress, flush=False))
+                except Exception as e:
+                    print(f"Error indexing '{object_name}': {e}")
+                    self.checkpoint.mark(collection_name, [object_name], "failed", error=str(e))
+                    result["failed"] += 1
+
+        for summary in runs:
+            result["pages"] += summary["pages_changed"]
+            result["chunks"] += summary["chunks"]
+        result["skipped"] = len(skipped)
+        result["indexed"] = len(finished) - len(skipped)
+        result["embeddings"] = pipeline.embedder.stats()["texts"] - embedded_before
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index every object under a MinIO bucket prefix")
+    parser.add_argument("--prefix", default="", help="Object name prefix, the whole bucket if empty")
+    parser.add_argument("--workers", type=int, default=None, help="Batches indexed concurrently")
+    parser.add_argument("--batch-size", type=int, default=None, help="Objects per pipeline run")
+    parser.add_argument("--checkpoint", default=None, help="Path to the checkpoint database")
+    args = parser.parse_args()
+
+    indexer = BulkIndexer(workers=args.workers, batch_size=args.batch_size, checkpoint=BulkCheckpoint(args.checkpoint))
+    totals = indexer.run(args.prefix)
+    print(f"Indexed {totals['indexed']} objects ({totals['skipped']} skipped, {totals['failed']} failed) in {totals['seconds']}s: "
+          f"{totals['docs_per_second']} docs/s, {totals['chunks_per_second']} chunks/s, {totals['embeddings_per_second']} embeddings/s, "
+          f"{totals['insert_rows_per_second']} inserted rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.schema import NodeRelationship, TextNode
+
+from embedding import estimate_tokens
+
+
+CHUNKING_MODES = ("fixed", "semantic", "hybrid")
+
+
+def chunking_mode(value: Optional[str] = None) -> str:
+    """
+    Returns the chunking mode, from CHUNKING_MODE by default (semantic if unset)
+
+    Raises:
+        ValueError: If the mode is not supported
+    """
+    value = (value or os.getenv("CHUNKING_MODE") or "semantic").lower()
+    if value not in CHUNKING_MODES:
+        raise ValueError(f"Unsupported chunking mode: {value}. Choose from {', '.join(CHUNKING_MODES)}")
+    return value
+
+
+class Chunker():
+
+    """Splits pages into chunks in one of three modes:
+       - fixed: sentence-aware chunks of `chunk_size` tokens, no embeddings
+       - semantic: pages are pre-split into sentences, every sentence group of the batch is embedded
+         in the same large requests, and chunks break where the cosine distance between consecutive
+         groups is above the `breakpoint_percentile` of the page
+       - hybrid: semantic splitting for pages above `semantic_min_tokens`, fixed chunks for the others
+       Semantic chunks are embedded with the mean of their sentence group embeddings, so they are
+       not sent to the embedder a second time.
+
+    Args:
+        embedder (BaseEmbedding): Embedder of the sentence groups
+        mode (Optional[str], optional): fixed, semantic or hybrid. Defaults to CHUNKING_MODE or semantic.
+        chunk_size (int): Largest chunk in tokens. Defaults to 512.
+        buffer_size (int): Sentences on each side embedded with a sentence. Defaults to 1.
+        breakpoint_percentile (float): Percentile of the distances above which a chunk breaks. Defaults to 95.
+        semantic_min_tokens (Optional[int], optional): Smallest page split semantically in hybrid mode.
+            Defaults to CHUNKING_SEMANTIC_MIN_TOKENS or `chunk_size`.
+        reuse_embeddings (Optional[bool], optional): Embed semantic chunks from their sentence groups.
+            Defaults to CHUNKING_REUSE_EMBEDDINGS or true.
+
+    """
+
+    def __init__(self, embedder: BaseEmbedding, mode: Optional[str] = None, chunk_size: int = 512,
+                 buffer_size: int = 1, breakpoint_percentile: float = 95,
+                 semantic_min_tokens: Optional[int] = None, reuse_embeddings: Optional[bool] = None):
+        self.embedder = embedder
+        self.mode = chunking_mode(mode)
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile = breakpoint_percentile
+        self.semantic_min_tokens = semantic_min_tokens or int(os.getenv("CHUNKING_SEMANTIC_MIN_TOKENS") or chunk_size)
+        if reuse_embeddings is None:
+            reuse_embeddings = (os.getenv("CHUNKING_REUSE_EMBEDDINGS") or "true").lower() == "true"
+        self.reuse_embeddings = reuse_embeddings
+        self.fixed_splitter = SentenceSplitter(chunk_size=chunk_size)
+        self.sentence_splitter = split_by_sentence_tokenizer()
+
+    def chunk(self, documents: List[Document]) -> List[TextNode]:
+        """
+        Chunks the documents, keeping their metadata and the offsets of the chunks in their text
+
+        Returns:
+            List[TextNode]: Chunks in document order, with their embedding when it was reused
+        """
+        # Blank pages (e.g. scanned pages without a text layer) have no chunks
+        documents = [doc for doc in documents if doc.text.strip()]
+        if self.mode == "fixed":
+            semantic = [False] * len(documents)
+        elif self.mode == "semantic":
+            semantic = [True] * len(documents)
+        else:
+            semantic = [estimate_tokens(doc.text) > self.semantic_min_tokens for doc in documents]
+
+        semantic_chunks = iter(self.chunk_semantic([doc for doc, split in zip(documents, semantic) if split]))
+
+        # Back to the order of the documents
+        chunks = []
+        for doc, split in zip(documents, semantic):
+            chunks.extend(next(semantic_chunks) if split else self.fixed_splitter.get_nodes_from_documents([doc]))
+        return chunks
+
+    def chunk_semantic(self, documents: List[Document]) -> List[List[TextNode]]:
+        """
+        Returns the chunks of each document
+        """
+        if not documents:
+            return []
+
+        # Sentences concatenate back to the text, so their offsets are running lengths
+        sentences = [self.sentence_splitter(doc.text) for doc in documents]
+        groups = [group for doc_sentences in sentences for group in self.sentence_groups(doc_sentences)]
+        if not groups:
+            return [[] for _ in documents]
+
+        # One embedding call for the sentence groups of every page of the batch
+        embeddings = self.embedder.get_text_embedding_batch(groups)
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+        chunks = []
+        offset = 0
+        for doc, doc_sentences in zip(documents, sentences):
+            doc_embeddings = embeddings[offset:offset + len(doc_sentences)]
+            offset += len(doc_sentences)
+            doc_chunks = [
+                self.build_chunk(doc, doc_sentences, start, end, doc_embeddings)
+                for start, end in self.split_points(doc_sentences, doc_embeddings)
+            ]
+            chunks.append([chunk for chunk in doc_chunks if chunk.text])
+        return chunks
+
+    def sentence_groups(self, sentences: List[str]) -> List[str]:
+        """
+        Returns each sentence joined with `buffer_size` sentences on each side
+        """
+        return [
+            "".join(sentences[max(0, i - self.buffer_size):i + 1 + self.buffer_size])
+            for i in range(len(sentences))
+        ]
+
+    def split_points(self, sentences: List[str], embeddings: np.ndarray) -> List[tuple]:
+        """
+        Returns the [start, end) sentence ranges of the chunks of a page: breaks where consecutive
+        sentence groups are most distant, and where a chunk would exceed `chunk_size` tokens
+        """
+        if len(sentences) == 0:
+            return []
+
+        breaks = np.zeros(len(sentences), dtype=bool)
+        if len(sentences) > 1:
+            distances = 1 - np.sum(embeddings[:-1] * embeddings[1:], axis=1)
+            # breaks[i] starts a new chunk at sentence i
+            breaks[1:] = distances > np.percentile(distances, self.breakpoint_percentile)
+
+        ranges = []
+        start, tokens = 0, 0
+        for i, sentence in enumerate(sentences):
+            sentence_tokens = estimate_tokens(sentence)
+            if i > start and (breaks[i] or tokens + sentence_tokens > self.chunk_size):
+                ranges.append((start, i))
+                start, tokens = i, 0
+            tokens += sentence_tokens
+        ranges.append((start, len(sentences)))
+        return ranges
+
+    def build_chunk(self, doc: Document, sentences: List[str], start: int, end: int, embeddings: np.ndarray) -> TextNode:
+        start_char_idx = sum(len(sentence) for sentence in sentences[:start])
+        text = "".join(sentences[start:end])
+        # Same trimming as the fixed splitter, with the offsets following the text
+        stripped = text.strip()
+        start_char_idx += len(text) - len(text.lstrip())
+
+        embedding = None
+        if self.reuse_embeddings:
+            mean = embeddings[start:end].mean(axis=0)
+            embedding = (mean / (np.linalg.norm(mean) or 1)).tolist()
+
+        chunk = TextNode(
+            text=stripped,
+            start_char_idx=start_char_idx,
+            end_char_idx=start_char_idx + len(stripped),
+            metadata=dict(doc.metadata),
+            excluded_embed_metadata_keys=list(doc.excluded_embed_metadata_keys),
+            excluded_llm_metadata_keys=list(doc.excluded_llm_metadata_keys),
+            embedding=embedding,
+        )
+        chunk.relationships[NodeRelationship.SOURCE] = doc.as_related_node_info()
+        return chunk
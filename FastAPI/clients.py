@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import urllib3
+from minio import Minio
+from pymilvus import connections, utility
+
+
+class ClientRegistry():
+
+    """Process-wide MinIO and Milvus clients shared by the indexing and query pipelines and the API.
+       MinIO requests go through one urllib3 pool of `minio_pool_size` connections, and Milvus is
+       reached through one named connection alias that is health-checked at most every
+       `health_check_seconds` when used, and reconnected when the check fails.
+
+    Args:
+        minio_pool_size (Optional[int], optional): Connections kept per MinIO host. Defaults to MINIO_POOL_SIZE or 16.
+        milvus_alias (Optional[str], optional): Alias of the Milvus connection. Defaults to MILVUS_CONNECTION_ALIAS or "rag".
+        health_check_seconds (Optional[float], optional): Seconds between Milvus health checks. Defaults to MILVUS_HEALTH_CHECK_SECONDS or 30.
+
+    """
+
+    def __init__(self, minio_pool_size: Optional[int] = None, milvus_alias: Optional[str] = None,
+                 health_check_seconds: Optional[float] = None):
+        self.minio_pool_size = minio_pool_size or int(os.getenv("MINIO_POOL_SIZE") or 16)
+        self.alias = milvus_alias or os.getenv("MILVUS_CONNECTION_ALIAS") or "rag"
+        self.health_check_seconds = health_check_seconds or float(os.getenv("MILVUS_HEALTH_CHECK_SECONDS") or 30)
+        self.milvus_host = os.getenv("MILVUS_HOST")
+        self.milvus_port = os.getenv("MILVUS_PORT")
+        self._minio: Optional[Minio] = None
+        self._http: Optional[urllib3.PoolManager] = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._stats = {"milvus_connects": 0, "milvus_reconnects": 0, "milvus_health_checks": 0, "milvus_failed_checks": 0}
+
+    @property
+    def milvus_uri(self) -> str:
+        return f"http://{self.milvus_host}:{self.milvus_port}/"
+
+    def minio(self) -> Minio:
+        """
+        Returns the shared MinIO client
+        """
+        with self._lock:
+            if self._minio is None:
+                # Same timeouts and retries as the MinIO default client, with a larger pool.
+                # Requests wait for a free connection instead of opening and discarding extra sockets.
+                self._http = urllib3.PoolManager(
+                    timeout=urllib3.Timeout(connect=10, read=300),
+                    maxsize=self.minio_pool_size,
+                    block=True,
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+                )
+                self._minio = Minio(
+                    endpoint=os.getenv("MINIO_ENDPOINT"),  # Ensure this is 9000 for non-SSL
+                    access_key=os.getenv("MINIO_ACCESS_KEY"),
+                    secret_key=os.getenv("MINIO_SECRET_KEY"),
+                    secure=False,
+                    http_client=self._http,
+                )
+            return self._minio
+
+    def milvus(self) -> str:
+        """
+        Returns the alias of the shared Milvus connection, connecting on first use and
+        reconnecting when the periodic health check fails
+        """
+        with self._lock:
+            if not connections.has_connection(self.alias):
+                connections.connect(alias=self.alias, host=self.milvus_host, port=self.milvus_port)
+                self._stats["milvus_connects"] += 1
+                self._last_check = time.monotonic()
+
+            elif time.monotonic() - self._last_check > self.health_check_seconds and not self._check_milvus():
+                print(f"Milvus connection '{self.alias}' failed its health check, reconnecting")
+                connections.disconnect(self.alias)
+                connections.connect(alias=self.alias, host=self.milvus_host, port=self.milvus_port)
+                self._stats["milvus_reconnects"] += 1
+                self._last_check = time.monotonic()
+
+            return self.alias
+
+    def _check_milvus(self) -> bool:
+        self._stats["milvus_health_checks"] += 1
+        self._last_check = time.monotonic()
+        try:
+            utility.get_server_version(using=self.alias, timeout=5)
+            return True
+        except Exception:
+            self._stats["milvus_failed_checks"] += 1
+            return False
+
+    def health(self, bucket: Optional[str] = None) -> dict:
+        """
+        Checks that Milvus and the MinIO bucket answer, reconnecting to Milvus if needed
+
+        Returns:
+            dict: "ok" and the status and latency of each service
+        """
+        services = {}
+
+        start = time.perf_counter()
+        try:
+            utility.get_server_version(using=self.milvus(), timeout=5)
+            services["milvus"] = {"ok": True}
+        except Exception as e:
+            services["milvus"] = {"ok": False, "error": str(e)}
+        services["milvus"]["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        try:
+            bucket = bucket or os.getenv("MINIO_BUCKET_NAME")
+            if not self.minio().bucket_exists(bucket):
+                raise ValueError(f"Bucket '{bucket}' does not exist")
+            services["minio"] = {"ok": True}
+        except Exception as e:
+            services["minio"] = {"ok": False, "error": str(e)}
+        services["minio"]["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        return {"ok": all(service["ok"] for service in services.values()), **services}
+
+    def stats(self) -> dict:
+        """
+        Returns the utilisation of the MinIO connection pools (connections in use, idle and created,
+        requests served) and the Milvus connection counters
+        """
+        minio_pools = []
+        if self._http is not None:
+            for key in list(self._http.pools.keys()):
+                pool = self._http.pools.get(key)
+                if pool is None:
+                    continue
+                # The pool queue holds idle connections and empty slots, taken slots are in use
+                idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                in_use = pool.pool.maxsize - pool.pool.qsize() if pool.pool else 0
+                minio_pools.append({
+                    "host": f"{pool.host}:{pool.port}",
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                    "in_use": in_use,
+                    "idle": idle,
+                    "utilization": round(in_use / pool.pool.maxsize, 3) if pool.pool else 0.0,
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests,
+                })
+
+        with self._lock:
+            milvus = {"alias": self.alias, "connected": connections.has_connection(self.alias), **self._stats}
+        try:
+            # Channels of the MilvusClient of each vector store, shared by clients with the same URI
+            from pymilvus.client.connection_manager import ConnectionManager
+            milvus["client_channels"] = ConnectionManager.get_instance().get_stats()["total_connections"]
+        except ImportError:
+            pass
+        return {"minio": {"pool_size": self.minio_pool_size, "pools": minio_pools}, "milvus": milvus}
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> ClientRegistry:
+    """
+    Returns the process-wide client registry
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
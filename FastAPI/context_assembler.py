@@ -0,0 +1,135 @@
+import hashlib
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+
+from embedding import estimate_tokens
+from embedding_cache import normalize_text
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+class ContextAssembler():
+
+    """Builds the context of the prompt from retrieved nodes, in relevance order:
+       drops exact and near-duplicate chunks (MinHash over word shingles), merges chunks of the
+       same page that overlap or touch into one passage, and adds passages until the token budget
+       of the target LLM is spent.
+
+    Args:
+        token_budget (Optional[int], optional): Estimated tokens of context. Defaults to CONTEXT_TOKEN_BUDGET or 3000.
+        similarity_threshold (Optional[float], optional): Estimated Jaccard similarity above which a chunk is a
+            near-duplicate of a more relevant one. Defaults to CONTEXT_DEDUP_THRESHOLD or 0.8.
+        num_perm (int): MinHash permutations. Defaults to 64.
+        shingle_size (int): Words per shingle. Defaults to 3.
+
+    """
+
+    def __init__(self, token_budget: Optional[int] = None, similarity_threshold: Optional[float] = None,
+                 num_perm: int = 64, shingle_size: int = 3):
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET") or 3000)
+        self.similarity_threshold = similarity_threshold or float(os.getenv("CONTEXT_DEDUP_THRESHOLD") or 0.8)
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(0)
+        # Coefficients below 2^31 keep a * x + b below 2^64 for 32-bit shingle hashes
+        self._a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+
+    def assemble(self, nodes: List[NodeWithScore]) -> Tuple[str, dict]:
+        """
+        Returns the context string and how it was built: chunks retrieved, removed as duplicates,
+        merged and dropped for the budget, and tokens before and after assembly
+        """
+        tokens_before = estimate_tokens("\n\n".join(n.node.get_content() for n in nodes)) if nodes else 0
+        unique = self.deduplicate(nodes)
+        passages = self.merge_adjacent(unique)
+
+        context, tokens = [], 0
+        for passage in passages:
+            passage_tokens = estimate_tokens(passage)
+            # Skip passages that do not fit, a shorter less relevant one may still fit
+            if context and tokens + passage_tokens > self.token_budget:
+                continue
+            context.append(passage)
+            tokens += passage_tokens
+
+        context_str = "\n\n".join(context)
+        tokens_after = estimate_tokens(context_str) if context else 0
+        return context_str, {
+            "chunks": len(nodes),
+            "duplicates_removed": len(nodes) - len(unique),
+            "passages": len(passages),
+            "passages_dropped": len(passages) - len(context),
+            "context_tokens": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+        }
+
+    def deduplicate(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """
+        Removes chunks identical or nearly identical to a more relevant chunk
+        """
+        seen_hashes = set()
+        signatures = []
+        unique = []
+        for node in nodes:
+            text = normalize_text(node.node.get_content())
+            digest = hashlib.sha256(text.lower().encode("utf-8")).digest()
+            if digest in seen_hashes:
+                continue
+
+            signature = self.minhash(text)
+            if any(np.mean(signature == kept) >= self.similarity_threshold for kept in signatures):
+                continue
+
+            seen_hashes.add(digest)
+            signatures.append(signature)
+            unique.append(node)
+        return unique
+
+    def minhash(self, text: str) -> np.ndarray:
+        words = text.lower().split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+        # Universal hashing (a * x + b) mod p, one row per permutation
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(MERSENNE_PRIME)
+        return permuted.min(axis=1)
+
+    @staticmethod
+    def merge_adjacent(nodes: List[NodeWithScore]) -> List[str]:
+        """
+        Merges chunks of the same page that overlap or touch into one passage, removing the overlap.
+        A merged passage takes the place of its most relevant chunk.
+        """
+        groups = {}
+        order = []
+        for node in nodes:
+            metadata = node.node.metadata
+            key = (metadata.get("file_name"), metadata.get("page_num"))
+            if key == (None, None) or node.node.start_char_idx is None:
+                key = ("node", node.node.node_id)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(node.node)
+
+        passages = []
+        for key in order:
+            chunks = sorted(groups[key], key=lambda chunk: chunk.start_char_idx or 0)
+            spans = []  # [start, end, text]
+            for chunk in chunks:
+                text = chunk.get_content()
+                start = chunk.start_char_idx
+                if spans and start is not None and start <= spans[-1][1] + 1:
+                    # Overlapping or touching chunk: append only the part past the end of the passage
+                    overlap = spans[-1][1] - start
+                    spans[-1][2] += text[overlap:] if overlap >= 0 else " " + text
+                    spans[-1][1] = max(spans[-1][1], start + len(text))
+                else:
+                    spans.append([start or 0, (start or 0) + len(text), text])
+            passages.extend(span[2] for span in spans)
+        return passages
@@ -0,0 +1,276 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from embedding_cache import EmbeddingCache, get_embedding_cache
+
+
+CHARS_PER_TOKEN = 4  # Rough estimate for English text, avoids a tokenizer dependency
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a text from its length
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """
+    Extracts the HTTP status code from an embedding client error, if it has one
+    """
+    for attr in ("status_code", "status", "http_status"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def embed_query_batch(embedder: BaseEmbedding, queries: List[str]) -> List[Embedding]:
+    """
+    Embeds many queries in one request. NVIDIA embedders are asked for query embeddings
+    (input_type="query"), other embedders (Azure OpenAI) make no query/passage distinction
+    and embed the queries as texts.
+    """
+    client = getattr(embedder, "_client", None)
+    if embedder.class_name() == "NVIDIAEmbedding" and client is not None:
+        extra_body = {"input_type": "query", "truncate": embedder.truncate}
+        if embedder.dimensions:
+            extra_body["dimensions"] = embedder.dimensions
+        data = client.embeddings.create(input=queries, model=embedder.model, extra_body=extra_body).data
+        return [d.embedding for d in data]
+    return embedder._get_text_embeddings(queries)
+
+
+class BatchedEmbedding(BaseEmbedding):
+
+    """Embedding layer around the NVIDIA/Azure embedders for bulk indexing.
+       Texts are packed into batches up to a token budget, up to `max_in_flight` batches are
+       sent concurrently, 429/5xx responses are retried with exponential backoff and jitter,
+       and the batch size grows while requests stay under `target_latency` and halves when
+       they are slower or throttled. Embeddings found in the cache are not requested again.
+
+    Args:
+        embedder (BaseEmbedding): Embedder making the actual API calls
+        cache (Optional[EmbeddingCache]): Cache of previously computed embeddings
+        max_batch_size (int): Largest number of texts in one request
+        max_batch_tokens (int): Largest estimated number of tokens in one request
+        max_in_flight (int): Number of concurrent requests
+        max_retries (int): Retries per batch on 429/5xx and connection errors
+        target_latency (float): Request latency in seconds the batch size adapts to
+
+    """
+
+    max_batch_size: int = Field(default=64, gt=0)
+    min_batch_size: int = Field(default=1, gt=0)
+    max_batch_tokens: int = Field(default=8192, gt=0)
+    max_in_flight: int = Field(default=4, gt=0)
+    max_retries: int = Field(default=5, ge=0)
+    backoff_seconds: float = Field(default=0.5, gt=0)
+    target_latency: float = Field(default=2.0, gt=0)
+
+    _embedder: BaseEmbedding = PrivateAttr()
+    _cache: Optional[EmbeddingCache] = PrivateAttr()
+    _batch_size: int = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _executor: ThreadPoolExecutor = PrivateAttr()
+    _stats: dict = PrivateAttr()
+
+    def __init__(self, embedder: BaseEmbedding, cache: Optional[EmbeddingCache] = None, **kwargs):
+        # Every text of a get_text_embedding_batch window is handed to _get_text_embeddings at once
+        kwargs.setdefault("embed_batch_size", 2048)
+        super().__init__(model_name=embedder.model_name, **kwargs)
+        self._embedder = embedder
+        self._cache = cache
+        self._batch_size = max(self.min_batch_size, self.max_batch_size // 2)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embedding")
+        self._stats = {"requests": 0, "texts": 0, "retries": 0, "throttled": 0, "request_seconds": 0.0}
+
+    @classmethod
+    def from_env(cls, embedder: BaseEmbedding) -> "BatchedEmbedding":
+        """
+        Wraps the embedder using the EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_BATCH_TOKENS,
+        EMBEDDING_MAX_IN_FLIGHT, EMBEDDING_MAX_RETRIES and EMBEDDING_TARGET_LATENCY settings
+        and the process-wide embedding cache
+        """
+        settings = {
+            "max_batch_size": os.getenv("EMBEDDING_MAX_BATCH_SIZE"),
+            "max_batch_tokens": os.getenv("EMBEDDING_MAX_BATCH_TOKENS"),
+            "max_in_flight": os.getenv("EMBEDDING_MAX_IN_FLIGHT"),
+            "max_retries": os.getenv("EMBEDDING_MAX_RETRIES"),
+            "target_latency": os.getenv("EMBEDDING_TARGET_LATENCY"),
+        }
+        kwargs = {
+            key: float(value) if key == "target_latency" else int(value)
+            for key, value in settings.items() if value
+        }
+        return cls(embedder, cache=get_embedding_cache(), **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedEmbedding"
+
+    @property
+    def embedder(self) -> BaseEmbedding:
+        return self._embedder
+
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        return self._cache
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        if self._cache is not None:
+            cached = self._cache.get_many(self.model_name, "query", [query])[0]
+            if cached is not None:
+                return cached
+
+        # Same request as batched queries, so a query has one embedding whichever path embeds it
+        embedding = self._with_retry(embed_query_batch, self._embedder, [query])[0]
+        if self._cache is not None:
+            self._cache.put_many(self.model_name, "query", [query], [embedding])
+        return embedding
+
+    def get_query_embeddings(self, queries: List[str]) -> List[Embedding]:
+        """
+        Embeds many queries at once. Cached queries are not requested again, and the others are
+        sent in batched requests, split by the same batch size and token budget as texts.
+        """
+        embeddings = self._cache.get_many(self.model_name, "query", queries) if self._cache is not None else [None] * len(queries)
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            computed = dict(zip(missing, self._embed_texts(missing, queries=True)))
+            if self._cache is not None:
+                self._cache.put_many(self.model_name, "query", missing, [computed[query] for query in missing])
+            embeddings = [computed[query] if embedding is None else embedding for query, embedding in zip(queries, embeddings)]
+
+        return embeddings
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        if self._cache is None:
+            return self._embed_texts(texts)
+
+        embeddings = self._cache.get_many(self.model_name, "text", texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # Identical texts within the batch are only embedded once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(missing_texts, self._embed_texts(missing_texts)))
+            self._cache.put_many(self.model_name, "text", missing_texts, [computed[text] for text in missing_texts])
+            for i in missing:
+                embeddings[i] = computed[texts[i]]
+
+        return embeddings
+
+    def _embed_texts(self, texts: List[str], queries: bool = False) -> List[Embedding]:
+        embeddings: List[Optional[Embedding]] = [None] * len(texts)
+        batch_starts = {}
+        start = 0
+
+        try:
+            while start < len(texts) or batch_starts:
+                # Keep up to max_in_flight batches running, sized with the current batch size
+                while start < len(texts) and len(batch_starts) < self.max_in_flight:
+                    end = self._next_batch_end(texts, start)
+                    future = self._executor.submit(self._embed_batch, texts[start:end], queries)
+                    batch_starts[future] = start
+                    start = end
+
+                done, _ = wait(batch_starts, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_start = batch_starts.pop(future)
+                    batch_embeddings = future.result()
+                    embeddings[batch_start:batch_start + len(batch_embeddings)] = batch_embeddings
+
+        except Exception:
+            for future in batch_starts:
+                future.cancel()
+            raise
+
+        return embeddings
+
+    def _next_batch_end(self, texts: List[str], start: int) -> int:
+        """
+        Returns the end of the batch starting at `start`, bounded by the batch size and token budget
+        """
+        batch_size = self._batch_size
+        end = start
+        tokens = 0
+        while end < len(texts) and end - start < batch_size:
+            tokens += estimate_tokens(texts[end])
+            # A single text above the budget is still sent on its own
+            if tokens > self.max_batch_tokens and end > start:
+                break
+            end += 1
+        return end
+
+    def _embed_batch(self, texts: List[str], queries: bool = False) -> List[Embedding]:
+        start = time.perf_counter()
+        if queries:
+            embeddings = self._with_retry(embed_query_batch, self._embedder, texts)
+        else:
+            embeddings = self._with_retry(self._embedder._get_text_embeddings, texts)
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["request_seconds"] += latency
+            # Additive increase while under the latency target, multiplicative decrease above it
+            if latency <= self.target_latency:
+                if len(texts) >= self._batch_size:
+                    self._batch_size = min(self.max_batch_size, self._batch_size + max(1, self._batch_size // 4))
+            else:
+                self._batch_size = max(self.min_batch_size, self._batch_size // 2)
+
+        return embeddings
+
+    def _with_retry(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                status_code = get_status_code(e)
+                retryable = status_code in RETRYABLE_STATUS_CODES or isinstance(e, (ConnectionError, TimeoutError))
+                if not retryable or attempt == self.max_retries:
+                    raise
+
+                with self._lock:
+                    self._stats["retries"] += 1
+                    if status_code == 429:
+                        self._stats["throttled"] += 1
+                        self._batch_size = max(self.min_batch_size, self._batch_size // 2)
+
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, self.backoff_seconds * 2 ** attempt))
+
+    def stats(self) -> dict:
+        """
+        Returns request counters, the current batch size and the average request latency
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["batch_size"] = self._batch_size
+            stats["avg_request_seconds"] = stats["request_seconds"] / stats["requests"] if stats["requests"] else 0.0
+            return stats
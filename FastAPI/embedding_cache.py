@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes unicode and whitespace so trivially different copies of a text share a cache entry
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model_name: str, kind: str, text: str) -> str:
+    """
+    Content address of an embedding: the model, the kind of embedding (text or query) and the normalized text
+    """
+    digest = hashlib.sha256(f"{model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache():
+
+    """Persistent, size-bounded LRU cache of embeddings stored in SQLite.
+
+    Args:
+        db_path (Optional[str], optional): Path to the SQLite database. Defaults to EMBEDDING_CACHE_PATH or "./embedding_cache.db".
+        max_entries (Optional[int], optional): Entries kept before the least recently used are evicted.
+            Defaults to EMBEDDING_CACHE_MAX_ENTRIES or 1,000,000.
+
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.db_path = db_path or os.getenv("EMBEDDING_CACHE_PATH") or "./embedding_cache.db"
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES") or 1_000_000)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, model_name: str, kind: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up the embeddings of the texts, None for texts that are not cached
+        """
+        keys = [cache_key(model_name, kind, text) for text in texts]
+        found = {}
+
+        with self._connect() as conn:
+            # Stay below SQLite's limit on the number of bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+
+        with self._lock:
+            self._hits += sum(1 for key in keys if key in found)
+            self._misses += sum(1 for key in keys if key not in found)
+
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model_name: str, kind: str, texts: List[str], embeddings: List[List[float]]):
+        """
+        Stores the embeddings of the texts, evicting the least recently used entries when full
+        """
+        now = time.time()
+        rows = [
+            (cache_key(model_name, kind, text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            inserted = conn.total_changes - before
+
+        with self._lock:
+            self._entries += inserted
+            over_capacity = self._entries > self.max_entries
+
+        if over_capacity:
+            self.evict()
+
+    def evict(self):
+        """
+        Evicts the least recently used entries down to 90% of the capacity
+        """
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            excess = entries - int(self.max_entries * 0.9)
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+        with self._lock:
+            self._evictions += max(0, excess)
+            self._entries = entries - max(0, excess)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of this process and the number of cached entries
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+            }
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(db_path: Optional[str] = None) -> Optional[EmbeddingCache]:
+    """
+    Returns the process-wide embedding cache, or None if disabled with EMBEDDING_CACHE_ENABLED=false.
+    Sharing one instance keeps the hit and miss counters for all pipelines of the process.
+    """
+    if (os.getenv("EMBEDDING_CACHE_ENABLED") or "true").lower() == "false":
+        return None
+
+    db_path = db_path or os.getenv("EMBEDDING_CACHE_PATH") or "./embedding_cache.db"
+    with _shared_caches_lock:
+        if db_path not in _shared_caches:
+            _shared_caches[db_path] = EmbeddingCache(db_path)
+        return _shared_caches[db_path]
@@ -1,17 +1,32 @@
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional
 import os
-import PyPDF2
-from io import BytesIO
+import shutil
+import sys
+import tempfile
+import threading
 
 from llama_index.embeddings.nvidia import NVIDIAEmbedding
-from llama_index.core.node_parser import SemanticSplitterNodeParser, SentenceSplitter
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, Document
-from llama_index.core.schema import BaseNode
+from llama_index.core import Document
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.vector_stores import MetadataFilter, MetadataFilters
 from llama_index.vector_stores.milvus import MilvusVectorStore
+from embedding import BatchedEmbedding
+from chunking import Chunker
+from staged_pipeline import Stage, StagedPipeline
+from vector_writer import VectorWriter
+from manifest import IndexManifest, hash_text
+from sparse_index import SparseIndex
+from local_vector_store import LocalVectorStore, vector_store_backend
+import milvus_settings
 
-from minio import Minio
-from pymilvus import Collection, connections, utility
+# Shared parsers package lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers import default_registry
+from parsers.parallel import extraction_workers
+
+from pymilvus import Collection, DataType, utility
+from clients import get_client_registry
 
 
 #To be removed
@@ -22,6 +37,24 @@ load_dotenv()
 os.environ["NVIDIA_API_KEY"] = os.getenv("NVIDIA_API_KEY")
 
 
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Yields lists of up to `size` items from an iterable without materialising it
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Chunk metadata stored as typed scalar fields of the Milvus collection
+SCALAR_FIELDS = {"file_name": DataType.VARCHAR, "page_num": DataType.INT64}
+
+
 class Indexing_Pipeline():
 
     """Pipeline for indexing the documents.
@@ -37,57 +70,116 @@ class Indexing_Pipeline():
         self.milvus_host_IP = os.getenv("MILVUS_HOST")
         self.model_host = os.getenv("MODEL_HOST")
         self.embedder = self.initialize_embedder()
+        # Fixed, semantic or hybrid chunking (CHUNKING_MODE)
+        self.chunker = Chunker(self.embedder, chunk_size=self.chunk_size)
         self.minio_bucket = os.getenv("MINIO_BUCKET_NAME")
-        self.minio_client = Minio(
-                                endpoint=os.getenv("MINIO_ENDPOINT"),  # Ensure this is 9000 for non-SSL
-                                access_key=os.getenv("MINIO_ACCESS_KEY"),
-                                secret_key=os.getenv("MINIO_SECRET_KEY"),
-                                secure=False  
-                            )
+        # MinIO and Milvus clients are shared by every pipeline of the process
+        self.clients = get_client_registry()
+        self.minio_client = self.clients.minio()
+        # Vector store of the chunks: Milvus, or the in-process store with VECTOR_STORE_BACKEND=local
+        self.vector_store_backend = vector_store_backend()
         self.milvus_store = None
-
-    def read_document(self, path:List[str]) -> List[Document]:
-        """Reads documents from the given path
+        # Inserts the vectors in batches of VECTOR_WRITE_BATCH_SIZE rows, created with the store
+        self.vector_writer = None
+        self.write_batch_size = int(os.getenv("VECTOR_WRITE_BATCH_SIZE") or 1000)
+        # Vector index built for new collections (MILVUS_INDEX_TYPE, MILVUS_INDEX_PARAMS, MILVUS_METRIC_TYPE)
+        self.index_config = milvus_settings.index_config()
+        self.similarity_metric = milvus_settings.similarity_metric()
+        self.manifest = IndexManifest()
+        # BM25 index kept in step with Milvus for hybrid retrieval
+        self.sparse_index = SparseIndex()
+        # Number of pages chunked, embedded and upserted together
+        self.page_batch_size = int(os.getenv("INDEX_PAGE_BATCH_SIZE") or 16)
+        # Pages are extracted on a process pool when more than one worker is configured
+        self.extraction_workers = extraction_workers()
+        self.parser_registry = default_registry()
+        # Threads of each ingest stage, and items (files, then batches of pages) queued between stages
+        self.stage_workers = {
+            "fetch": int(os.getenv("INDEX_FETCH_WORKERS") or 2),
+            "parse": int(os.getenv("INDEX_PARSE_WORKERS") or 1),
+            "chunk": int(os.getenv("INDEX_CHUNK_WORKERS") or 1),
+            "embed": int(os.getenv("INDEX_EMBED_WORKERS") or 2),
+            "upsert": int(os.getenv("INDEX_UPSERT_WORKERS") or 1),
+        }
+        self.stage_queue_size = int(os.getenv("INDEX_STAGE_QUEUE_SIZE") or 4)
+        self.lock = threading.Lock()
+
+    def read_document(self, path:List[str]) -> Iterator[Document]:
+        """Reads documents from the given path, one page at a time.
+           Each object is streamed from MinIO into a temporary file and parsed lazily with the
+           backend the shared parser registry chooses for its format, so memory use does not
+           grow with the size of the document.
         
         Args:
             path (List[str]): List of paths to the files (pdf, docx)
         
-        Returns:
-            List[Document]: List of documents (each document is a page of the file with associated metadata)
+        Yields:
+            Document: A page of the file with associated metadata
         
         """
-        documents = []
-
         for file_name in path:
-            # Fetch the file from MinIO
-            response = self.minio_client.get_object(self.minio_bucket, file_name)
-            file_content = response.read()  # Read the file as binary
-            
-            if file_name.endswith('.pdf'):
-                # Handle PDF files
-                pdf_stream = BytesIO(file_content)
-                pdf_reader = PyPDF2.PdfReader(pdf_stream)
+            spool, content_type = self.fetch_document(file_name)
+            with spool:
+                yield from self.parse_document(file_name, spool.name, content_type)
 
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    pdf_text = page.extract_text() or ""
+    def parse_document(self, file_name: str, file_path: str, content_type: Optional[str]) -> Iterator[Document]:
+        """
+        Parses a fetched file one page at a time, yielding nothing if its format is not supported
+        """
+        try:
+            parser = self.parser_registry.get_backend(file_name, mime_type=content_type)
+        except ValueError as e:
+            print(f"Skipping '{file_name}': {e}")
+            return
+
+        for page in parser.parse(file_path, workers=self.extraction_workers):
+             # Sanitize the extracted text
+            text = page["text"].encode('utf-8', 'ignore').decode('utf-8', 'ignore')
 
-                     # Sanitize the extracted text
-                    pdf_text = pdf_text.encode('utf-8', 'ignore').decode('utf-8', 'ignore')
+            yield Document(text=text, metadata={"file_name": file_name, "page_num": page["page_num"]})
 
-                    documents.append(Document(text=pdf_text, metadata={"file_name": file_name, "page_num": page_num}))
+    def fetch_document(self, file_name: str):
+        """Streams an object from MinIO into a temporary file and releases the connection
+
+        Args:
+            file_name (str): Name of the file in the MinIO bucket
 
-        return documents
+        Returns:
+            Tuple[tempfile.NamedTemporaryFile, Optional[str]]: Temporary file positioned at the start of the object,
+                to be closed by the caller, and the content type of the object
+        """
+        spool = tempfile.NamedTemporaryFile(suffix=os.path.splitext(file_name)[1])
+        response = None
+        try:
+            # Fetch the file from MinIO
+            response = self.minio_client.get_object(self.minio_bucket, file_name)
+            shutil.copyfileobj(response, spool, length=1024 * 1024)
+            spool.flush()
+            spool.seek(0)
+            return spool, response.headers.get("Content-Type")
+
+        except Exception:
+            spool.close()
+            raise
+
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
     
     def initialize_embedder(self):
         """
-        Initializes the embedder based on the model host (NVIDIA or Azure)
+        Initializes the embedder based on the model host (NVIDIA or Azure),
+        wrapped for batched and concurrent embedding of the chunks
         """
 
         if self.model_host == "NVIDIA":
+            # EMBEDDING_BASE_URL points the embedder at a self-hosted NIM or the local stub server
+            base_url = os.getenv('EMBEDDING_BASE_URL')
             embedder = NVIDIAEmbedding(
                 model=os.getenv('EMBEDDING_MODEL'),
-                truncate="END")
+                truncate="END",
+                **({"base_url": base_url} if base_url else {}))
 
         elif self.model_host == "AZURE":
             embedder = AzureOpenAIEmbedding(
@@ -98,7 +190,7 @@ class Indexing_Pipeline():
                 api_key=os.getenv('API_KEY')
             )  
 
-        return embedder
+        return BatchedEmbedding.from_env(embedder)
 
     def chunk_document(self, documents:List[Document], chunk_size:int) -> List[BaseNode]:
         """Chunks the document into smaller parts
@@ -107,13 +199,10 @@ class Indexing_Pipeline():
             documents (List[Document]): List of documents
 
         Returns:
-            List[BaseNode]: List of chunks
+            List[BaseNode]: List of chunks, semantic chunks with the embedding of their sentences
         """
-        base_splitter = SentenceSplitter(chunk_size=chunk_size) 
-        splitter = SemanticSplitterNodeParser(
-            buffer_size=1, breakpoint_percentile_threshold=95, embed_model=self.embedder, base_splitter=base_splitter
-        )
-        chunks = splitter.get_nodes_from_documents(documents)
+        chunker = self.chunker if chunk_size == self.chunker.chunk_size else Chunker(self.embedder, chunk_size=chunk_size)
+        chunks = chunker.chunk(documents)
         print(f"Chunked the document into {len(chunks)} chunks")
 
         return chunks
@@ -131,17 +220,27 @@ class Indexing_Pipeline():
         
         """
         if self.milvus_store:
-            return f"Milvus store already initialized at {self.milvus_store.uri}, skipping initialization"
+            return f"Vector store already initialized for '{self.collection_name}', skipping initialization"
+
+        if self.vector_store_backend == "local":
+            self.milvus_store = LocalVectorStore(
+                collection_name=self.collection_name, dim=dim, similarity_metric=self.similarity_metric
+            )
+            print(f"Initialized local vector store at {self.milvus_store.path} with {self.milvus_store.dim} dimensions")
+            return
         
-        connections.connect(host=self.milvus_host_IP, port=self.milvus_port)
+        alias = self.clients.milvus()
         
         # Check if the collection already exists
-        if utility.has_collection(self.collection_name):
+        if utility.has_collection(self.collection_name, using=alias):
             print(f"Milvus collection '{self.collection_name}' already exists. Reusing the existing collection.")
             self.milvus_store = MilvusVectorStore(
                 collection_name=self.collection_name,
-                uri=f"http://{self.milvus_host_IP}:{self.milvus_port}/",
-                overwrite=False  # Avoid overwriting the existing collection
+                uri=self.clients.milvus_uri,
+                overwrite=False,  # Avoid overwriting the existing collection
+                batch_size=self.write_batch_size,
+                index_config=self.index_config,  # Only used if the collection has no index yet
+                similarity_metric=self.similarity_metric,
             )
         else:
             # Initialize a new collection if it does not exist
@@ -149,40 +248,101 @@ class Indexing_Pipeline():
             self.milvus_store = MilvusVectorStore(
                 dim=dim,
                 collection_name=self.collection_name,
-                uri=f"http://{self.milvus_host_IP}:{self.milvus_port}/",
-                overwrite=True  
+                uri=self.clients.milvus_uri,
+                overwrite=True,
+                batch_size=self.write_batch_size,
+                index_config=self.index_config,
+                similarity_metric=self.similarity_metric,
+                # Filters on file and page are applied by Milvus before the ANN search
+                scalar_field_names=list(SCALAR_FIELDS),
+                scalar_field_types=list(SCALAR_FIELDS.values()),
             )
+        self.ensure_scalar_index()
         
         print(f"Initialized Milvus store at {self.milvus_store.uri} with {self.milvus_store.dim} dimensions")
+
+    def ensure_scalar_index(self):
+        """
+        Creates an inverted index on the file_name field, used by file filters and deletes.
+        Collections created before file_name was a scalar field keep it in the dynamic field, which cannot be indexed.
+        """
+        client = self.milvus_store.client
+        try:
+            if client.list_indexes(self.collection_name, field_name="file_name"):
+                return
+            index_params = client.prepare_index_params()
+            index_params.add_index(field_name="file_name", index_type="INVERTED", index_name="file_name")
+            client.create_index(self.collection_name, index_params)
+            print(f"Created an inverted index on file_name of '{self.collection_name}'")
+        except Exception as e:
+            print(f"Could not index file_name of '{self.collection_name}', re-create the collection to enable it: {e}")
         
    
+    def ensure_milvus_store(self):
+        """
+        Initializes the Milvus store based on the embedding model, if not already initialized
+        """
+        with self.lock:
+            if not self.milvus_store:
+                if self.embed_model == "NV-Embed-QA":
+                    self.initialize_milvus_store(dim=512)
+                elif self.embed_model == "text-embedding-ada-002":
+                    self.initialize_milvus_store(dim=1536)
+            if self.milvus_store and self.vector_writer is None:
+                self.vector_writer = VectorWriter(self.milvus_store, batch_size=self.write_batch_size)
+        
+    def collection_exists(self) -> bool:
+        """
+        Checks whether the collection exists, without creating it
+        """
+        if self.milvus_store:
+            return True
+        if self.vector_store_backend == "local":
+            return LocalVectorStore.exists(self.collection_name)
+        return utility.has_collection(self.collection_name, using=self.clients.milvus())
+
     def reset_milvus_store(self):
         """
         Resets the milvus store by dropping the collection and recreating empty collection
         """
-        connections.connect(host=self.milvus_host_IP, port=self.milvus_port)
-
         try:
-            collection = Collection(name=self.milvus_store.collection_name)
-            collection.drop()
+            if isinstance(self.milvus_store, LocalVectorStore):
+                self.milvus_store.drop()
+            else:
+                collection = Collection(name=self.milvus_store.collection_name, using=self.clients.milvus())
+                collection.drop()
+            self.manifest.delete_collection(self.milvus_store.collection_name)
+            self.sparse_index.delete_collection(self.milvus_store.collection_name)
             print(f"Deleted {self.milvus_store.collection_name} from milvus store, please re-run the indexing pipeline")
             self.milvus_store = None
+            self.vector_writer = None
 
         except Exception as e:
             print(f"Error deleting collection: {e}")
 
-# ERROR HERE
     def delete_milvus_indexes_using_filename(self, filename: str):
-        # Connect to Milvus
-        connections.connect(host=self.milvus_host_IP, port=self.milvus_port)
-        
+        """
+        Deletes every chunk of a file from Milvus, the BM25 index and the manifest
+
+        Args:
+            filename (str): Name of the file in the MinIO bucket
+
+        Returns:
+            dict: Status and message for the FastAPI response
+        """
         try:
-            # Initialize the collection
-            collection = Collection(name=self.collection_name)
-            
-            # Use a filter expression to delete all entries with the specific filename metadata
-            expr = f"file_name == '{filename}'"
-            collection.delete(expr)
+            # Deleting from a collection that does not exist must not create it
+            if not self.collection_exists():
+                print(f"Collection '{self.collection_name}' does not exist, nothing to delete for {filename}")
+                return {"status": "success", "message": f"No indexes for {filename}, collection '{self.collection_name}' does not exist"}
+            self.ensure_milvus_store()
+
+            # Chunks carry their file_name, so Milvus deletes them with a filter on the indexed field
+            self.milvus_store.delete_nodes(
+                filters=MetadataFilters(filters=[MetadataFilter(key="file_name", value=filename)])
+            )
+            node_ids = self.manifest.delete_file(self.collection_name, filename)
+            self.sparse_index.delete(self.collection_name, node_ids)
             
             print(f"Deleted indexes for {filename} from Milvus store")
             
@@ -194,40 +354,223 @@ class Indexing_Pipeline():
             return {"status": "error", "message": str(e)}
         
     
-    def run(self, path: List[str]) -> VectorStoreIndex:
+    def run(self, path: List[str], progress_callback: Optional[Callable[..., None]] = None, flush: bool = True) -> dict:
         """
-        Runs the indexing pipeline to index the documents
+        Runs the indexing pipeline to index the documents.
+        Files whose MinIO ETag is unchanged since they were last indexed are skipped,
+        and for changed files only the pages whose text changed are re-embedded.
+        The fetch, parse, chunk, embed and upsert stages run concurrently on batches of pages
+        connected by bounded queues (INDEX_<STAGE>_WORKERS threads each, INDEX_STAGE_QUEUE_SIZE
+        batches between stages), so later pages are parsed while earlier ones are embedded.
 
         Args:
             path (List[str]): List of paths to the files (pdf)
+            progress_callback (Optional[Callable[..., None]], optional): Called as callback(stage, **progress)
+                when a stage (fetch, parse, chunk, embed, upsert) starts and finishes.
+            flush (bool): Flush the collection at the end of the run. Bulk jobs flush once when they finish.
 
         Returns:
-            VectorStoreIndex: VectorStoreIndex object containing the indexed documents
+            dict: Number of files indexed and skipped, pages read and re-embedded, chunks inserted and deleted,
+                the throughput, utilisation and queue depth of each stage, and the insert counters of the writer
         """
-        documents = self.read_document(path)
-        chunks = self.chunk_document(documents, chunk_size=self.chunk_size)
-
-        # Initialize Milvus store based on the embedding model
-        if not self.milvus_store:
-            if self.embed_model == "NV-Embed-QA":
-                self.initialize_milvus_store(dim=512)
-            elif self.embed_model == "text-embedding-ada-002":
-                self.initialize_milvus_store(dim=1536)
-
-        # Initialize storage context with Milvus vector store
-        storage_context = StorageContext.from_defaults(vector_store=self.milvus_store)
-
-        # Add documents (or chunks) to the index
-        index = VectorStoreIndex.from_documents(
-            [Document(text=chunk.text) for chunk in chunks], storage_context=storage_context, embed_model=self.embedder
-        )
-
-        print(f"Indexed {len(chunks)} chunks into Milvus.")
-        return index
-
-
-
+        report_progress = progress_callback or (lambda stage, **progress: None)
+
+        summary = {"files": 0, "files_skipped": 0, "pages": 0, "pages_changed": 0, "chunks": 0, "chunks_deleted": 0}
+        pipeline = StagedPipeline([
+            Stage(name, getattr(self, f"{name}_stage"), workers=self.stage_workers[name], queue_size=self.stage_queue_size)
+            for name in ("fetch", "parse", "chunk", "embed", "upsert")
+        ])
+        # Every stage receives the file being indexed, with the progress callback and the run summary
+        files = [{"file_name": file_name, "report_progress": report_progress, "summary": summary} for file_name in path]
+        try:
+            stats = pipeline.run(iter(files))
+        except Exception:
+            self.discard_unfinished(files)
+            raise
+
+        for name, stage_stats in stats["stages"].items():
+            print(f"Stage {name}: {stage_stats['items_in']} items, {stage_stats['items_per_second']}/s, "
+                  f"utilization {stage_stats['utilization']:.0%}, max queue depth {stage_stats['max_queue_depth']}")
+        if flush and self.vector_writer:
+            self.vector_writer.finish()
+        summary["stages"] = stats["stages"]
+        summary["wall_seconds"] = stats["wall_seconds"]
+        summary["writer"] = self.vector_writer.stats() if self.vector_writer else None
+        return summary
+
+    def discard_unfinished(self, files: List[dict]):
+        """
+        Removes the nodes added by a failed run for the files it did not record in the manifest,
+        from the writer's buffer, the vector store and the BM25 index, so that indexing the files
+        again does not duplicate them. Their previously indexed chunks are kept.
+        """
+        node_ids = [node_id for file in files if not file.get("recorded") for node_id in file.get("node_ids", [])]
+        if not node_ids:
+            return
 
+        try:
+            if self.vector_writer:
+                self.vector_writer.discard(node_ids)
+            # Some of the nodes may already have been inserted by a full batch
+            self.milvus_store.delete_nodes(node_ids=node_ids)
+            self.sparse_index.delete(self.collection_name, node_ids)
+            print(f"Discarded {len(node_ids)} chunks of files whose indexing failed")
+        except Exception as e:
+            print(f"Error discarding the chunks of files whose indexing failed: {e}")
 
-        
+    def fetch_stage(self, file: dict) -> Iterator[dict]:
+        """
+        Skips the file if its ETag is unchanged since it was last indexed, otherwise fetches it from MinIO
+        """
+        file_name = file["file_name"]
+        file["report_progress"]("fetch", file_name=file_name)
+        etag = self.minio_client.stat_object(self.minio_bucket, file_name).etag
+        indexed = self.manifest.get_file(self.collection_name, file_name)
+
+        if indexed and indexed["etag"] == etag:
+            print(f"'{file_name}' is unchanged since it was last indexed, skipping.")
+            file["report_progress"]("upsert", status="skipped", file_name=file_name)
+            with self.lock:
+                file["summary"]["files_skipped"] += 1
+            return
+
+        spool, content_type = self.fetch_document(file_name)
+        # Page hashes of the last indexing, compared with the new ones to find the pages that changed
+        file.update({
+            "etag": etag,
+            "old_pages": indexed["pages"] if indexed else {},
+            "pages": {},
+            "counts": {"pages": 0, "pages_changed": 0, "chunks": 0},
+            "spool": spool,
+            "content_type": content_type,
+            "batches_pending": 0,
+            "parsed": False,
+            # Nodes added by this run, removed again if the run fails before the file is recorded
+            "node_ids": [],
+            "recorded": False,
+        })
+        yield file
+
+    def parse_stage(self, file: dict) -> Iterator[tuple]:
+        """
+        Parses the file into batches of pages and yields the batches with changed pages
+        """
+        counts = file["counts"]
+        with file.pop("spool") as spool:
+            pages = self.parse_document(file["file_name"], spool.name, file["content_type"])
+            for documents in batched(pages, self.page_batch_size):
+                changed_documents = []
+                for document in documents:
+                    page_num = document.metadata["page_num"]
+                    text_hash = hash_text(document.text)
+                    old_page = file["old_pages"].get(page_num)
+                    if old_page and old_page["text_hash"] == text_hash:
+                        file["pages"][page_num] = old_page
+                    else:
+                        file["pages"][page_num] = {"text_hash": text_hash, "node_ids": []}
+                        changed_documents.append(document)
+
+                counts["pages"] += len(documents)
+                counts["pages_changed"] += len(changed_documents)
+                file["report_progress"]("parse", pages=counts["pages"], pages_changed=counts["pages_changed"])
+
+                if changed_documents:
+                    with self.lock:
+                        file["batches_pending"] += 1
+                    yield file, changed_documents
+
+        with self.lock:
+            file["parsed"] = True
+            finished = file["batches_pending"] == 0
+        if finished:
+            self.finish_file(file)
+
+    def chunk_stage(self, batch: tuple) -> Iterator[tuple]:
+        file, documents = batch
+        file["report_progress"]("chunk", status="running")
+        chunks = self.chunk_document(documents, chunk_size=self.chunk_size)
+        file["report_progress"]("chunk", chunks=len(chunks))
+        yield file, chunks
 
+    def embed_stage(self, batch: tuple) -> Iterator[tuple]:
+        """
+        Embeds the chunks that did not reuse the embeddings of their sentences
+        """
+        file, chunks = batch
+        file["report_progress"]("embed", status="running")
+        # Chunks keep the file and page they come from, without it affecting their embedding or prompt
+        nodes = [
+            TextNode(
+                text=chunk.text,
+                # Offsets in the page let overlapping chunks of a page be merged into one passage
+                start_char_idx=chunk.start_char_idx,
+                end_char_idx=chunk.end_char_idx,
+                metadata={key: chunk.metadata[key] for key in SCALAR_FIELDS},
+                excluded_embed_metadata_keys=list(SCALAR_FIELDS),
+                excluded_llm_metadata_keys=list(SCALAR_FIELDS),
+                embedding=chunk.embedding,
+            )
+            for chunk in chunks
+        ]
+        missing = [node for node in nodes if node.embedding is None]
+        embeddings = self.embedder.get_text_embedding_batch([node.text for node in missing])
+        for node, embedding in zip(missing, embeddings):
+            node.embedding = embedding
+        file["report_progress"]("embed", embedded=len(missing), reused=len(nodes) - len(missing))
+        yield file, nodes
+
+    def upsert_stage(self, batch: tuple) -> None:
+        """
+        Hands a batch of nodes to the vector writer, and finishes the file once its last batch is upserted
+        """
+        file, nodes = batch
+        with self.lock:
+            file["node_ids"].extend(node.node_id for node in nodes)
+        if nodes:
+            self.ensure_milvus_store()
+            self.vector_writer.add(nodes)
+            self.sparse_index.add(self.collection_name, nodes)
+
+        # Chunks never span pages, so each node belongs to the page of its chunk
+        for node in nodes:
+            file["pages"][node.metadata["page_num"]]["node_ids"].append(node.node_id)
+
+        with self.lock:
+            file["counts"]["chunks"] += len(nodes)
+            file["batches_pending"] -= 1
+            finished = file["parsed"] and file["batches_pending"] == 0
+        file["report_progress"]("upsert", status="running", upserted=file["counts"]["chunks"])
+        if finished:
+            self.finish_file(file)
+
+    def finish_file(self, file: dict):
+        """
+        Deletes the chunks of pages that changed or no longer exist and records the file in the manifest
+        """
+        file_name = file["file_name"]
+        counts = file["counts"]
+        stale_ids = [
+            node_id
+            for page_num, old_page in file["old_pages"].items()
+            if file["pages"].get(page_num) is not old_page
+            for node_id in old_page["node_ids"]
+        ]
+
+        if stale_ids:
+            self.ensure_milvus_store()
+            self.milvus_store.delete_nodes(node_ids=stale_ids)
+            self.sparse_index.delete(self.collection_name, stale_ids)
+
+        # The file is only recorded as indexed once none of its vectors are left in the writer's buffer
+        if self.vector_writer:
+            self.vector_writer.write_pending()
+        self.manifest.record_file(self.collection_name, file_name, file["etag"], file["pages"])
+        file["recorded"] = True
+        file["report_progress"]("upsert", status="done", file_name=file_name, upserted=counts["chunks"], deleted=len(stale_ids))
+
+        print(f"Indexed {counts['chunks']} chunks from {counts['pages_changed']} changed pages of '{file_name}' into Milvus.")
+        with self.lock:
+            file["summary"]["files"] += 1
+            file["summary"]["chunks_deleted"] += len(stale_ids)
+            for key, value in counts.items():
+                file["summary"][key] += value
@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+from indexing import Indexing_Pipeline
+from worker_pool import WorkerPool, PoolFullError
+
+
+JOB_STAGES = ["fetch", "parse", "chunk", "embed", "upsert"]
+
+
+class JobStore():
+
+    """SQLite store for indexing jobs, so queued and finished jobs survive a restart.
+
+    Args:
+        db_path (Optional[str], optional): Path to the SQLite database. Defaults to JOBS_DB_PATH or "./jobs.db".
+
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("JOBS_DB_PATH") or "./jobs.db"
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create_job(self, file_name: str, max_queued: Optional[int] = None) -> dict:
+        job_id = self.create_jobs([file_name], max_queued=max_queued)[0]
+        return self.get_job(job_id)
+
+    def create_jobs(self, file_names: List[str], max_queued: Optional[int] = None, skip_active: bool = False) -> List[str]:
+        """
+        Creates queued jobs for many files in one transaction and returns their ids.
+        With `skip_active`, files that already have a queued or running job get no new job.
+
+        Raises:
+            PoolFullError: If the jobs would take the queue above `max_queued` jobs
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # The capacity check and the insert are one transaction, so concurrent requests cannot overfill the queue
+            conn.execute("BEGIN IMMEDIATE")
+            if skip_active:
+                active = {
+                    row["file_name"]
+                    for row in conn.execute("SELECT file_name FROM jobs WHERE status IN ('queued', 'running')")
+                }
+                file_names = [file_name for file_name in dict.fromkeys(file_names) if file_name not in active]
+            job_ids = [uuid.uuid4().hex for _ in file_names]
+            if max_queued is not None:
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued + len(file_names) > max_queued:
+                    raise PoolFullError(
+                        f"The indexing job queue cannot take {len(file_names)} more jobs ({queued} of {max_queued} queued)"
+                    )
+            conn.executemany(
+                "INSERT INTO jobs (id, file_name, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                [(job_id, file_name, now, now) for job_id, file_name in zip(job_ids, file_names)],
+            )
+        return job_ids
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim_next_job(self) -> Optional[dict]:
+        """
+        Atomically marks the oldest queued job as running and returns it
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row["id"])
+            )
+        return self.get_job(row["id"])
+
+    def update_job(self, job_id: str, status: Optional[str] = None, stage: Optional[str] = None,
+                   result: Optional[dict] = None, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                """UPDATE jobs SET status = COALESCE(?, status), stage = COALESCE(?, stage),
+                   result = COALESCE(?, result), error = COALESCE(?, error), updated_at = ? WHERE id = ?""",
+                (status, stage, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def update_stage(self, job_id: str, stage: str, progress: dict):
+        """
+        Records the current stage of a job and merges the progress reported for it
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job_progress = json.loads(row["progress"])
+            job_progress.setdefault(stage, {}).update(progress)
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(job_progress), time.time(), job_id),
+            )
+
+    def requeue_interrupted(self) -> int:
+        """
+        Puts jobs that were running when the service stopped back in the queue
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),)
+            )
+            return cursor.rowcount
+
+    def count_by_status(self) -> dict:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+def run_indexing_job(job_id: str, file_name: str, db_path: str) -> dict:
+    """
+    Runs the indexing pipeline for a single job and records its progress and outcome.
+    Module-level so it can run on a process pool as well as a thread pool.
+    """
+    store = JobStore(db_path)
+
+    def report_progress(stage: str, **progress):
+        store.update_stage(job_id, stage, progress)
+
+    try:
+        indexing_pipeline = Indexing_Pipeline()
+        result = indexing_pipeline.run([file_name], progress_callback=report_progress)
+        store.update_job(job_id, status="completed", stage="done", result=result)
+        return result
+
+    except Exception as e:
+        print(f"Error indexing document '{file_name}' (job {job_id}): {e}")
+        store.update_job(job_id, status="failed", error=str(e))
+        raise
+
+
+class IndexingJobQueue():
+
+    """Durable queue of indexing jobs drained concurrently by the indexing worker pool.
+       Jobs are kept in the JobStore, a dispatcher thread claims them in order and runs
+       up to `workers` of them at once on the pool.
+
+    Args:
+        store (JobStore): Store holding the queued jobs
+        pool (WorkerPool): Pool the jobs run on
+        workers (Optional[int], optional): Number of jobs run concurrently. Defaults to the pool size.
+        max_queued (Optional[int], optional): Number of queued jobs before new ones are rejected.
+            Defaults to JOBS_MAX_QUEUED or 8 times the queue size of the pool.
+
+    """
+
+    def __init__(self, store: JobStore, pool: WorkerPool, workers: Optional[int] = None, max_queued: Optional[int] = None):
+        self.store = store
+        self.pool = pool
+        self.workers = workers or pool.max_workers
+        # Jobs wait in SQLite rather than in the pool, so the backlog can be a few pool queues deep
+        self.max_queued = max_queued or int(os.getenv("JOBS_MAX_QUEUED") or 8 * max(1, pool.max_queue))
+        self._slots = threading.Semaphore(self.workers)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="indexing-job-dispatcher", daemon=True)
+
+    def start(self):
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            print(f"Requeued {requeued} interrupted indexing jobs")
+        self._dispatcher.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def enqueue(self, file_name: str) -> dict:
+        """
+        Adds an indexing job for the file to the queue
+
+        Raises:
+            PoolFullError: If the queue already holds `max_queued` jobs
+        """
+        job = self.store.create_job(file_name, max_queued=self.max_queued)
+        self._wakeup.set()
+        return job
+
+    def enqueue_many(self, file_names: List[str]) -> List[str]:
+        """
+        Adds an indexing job for each file to the queue, all or none of them. Files that already
+        have a queued or running job are skipped, so the same file is never indexed twice at once.
+
+        Returns:
+            List[str]: Ids of the jobs created
+
+        Raises:
+            PoolFullError: If the jobs would take the queue above `max_queued` jobs
+        """
+        job_ids = self.store.create_jobs(file_names, max_queued=self.max_queued, skip_active=True)
+        self._wakeup.set()
+        return job_ids
+
+    def _dispatch(self):
+        while not self._stopped.is_set():
+            if not self._slots.acquire(timeout=1):
+                continue
+
+            self._wakeup.clear()
+            job = self.store.claim_next_job()
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=1)
+                continue
+
+            try:
+                future = self.pool.submit(run_indexing_job, job["id"], job["file_name"], self.store.db_path)
+            except PoolFullError:
+                # Other work (e.g. deletes) is holding the pool, retry the job shortly
+                self.store.update_job(job["id"], status="queued")
+                self._slots.release()
+                time.sleep(0.5)
+                continue
+
+            future.add_done_callback(lambda f: self._slots.release())
@@ -0,0 +1,377 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+
+def vector_store_backend() -> str:
+    """
+    Returns the vector store backend of the pipelines: "milvus" (default) or "local", from VECTOR_STORE_BACKEND
+    """
+    backend = (os.getenv("VECTOR_STORE_BACKEND") or "milvus").lower()
+    if backend not in ("milvus", "local"):
+        raise ValueError(f"Unsupported vector store backend: {backend}")
+    return backend
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+
+    """In-process vector store for embedded and offline deployments (small tenants, CI).
+       Vectors are appended to a float32 matrix on disk that is memory-mapped on first query,
+       nodes and their metadata are kept in SQLite next to it. Search is brute force over the matrix,
+       or an HNSW graph when `index_type="hnsw"` (requires hnswlib). Filtered searches are always
+       exact over the matching rows. Writers from several processes are serialised by SQLite.
+
+    Args:
+        collection_name (str): Name of the collection, a directory under `path`
+        dim (Optional[int]): Dimension of the vectors, required to create the collection
+        path (Optional[str]): Root directory of the collections. Defaults to LOCAL_VECTOR_STORE_PATH or "./vector_store".
+        similarity_metric (str): IP, COSINE or L2. Defaults to "IP".
+        index_type (Optional[str]): "flat" or "hnsw". Defaults to LOCAL_VECTOR_INDEX or "flat".
+        overwrite (bool): Drop the collection if it exists. Defaults to False.
+
+    """
+
+    stores_text: bool = True
+    collection_name: str
+    dim: Optional[int] = None
+    path: str
+    similarity_metric: str = "IP"
+    index_type: str = "flat"
+
+    _lock: threading.Lock = PrivateAttr()
+    _version: int = PrivateAttr()
+    _vectors: Optional[np.ndarray] = PrivateAttr()
+    _alive: Optional[np.ndarray] = PrivateAttr()
+    _norms: Optional[np.ndarray] = PrivateAttr()
+    _hnsw: Any = PrivateAttr()
+    _hnsw_rows: int = PrivateAttr()
+    _hnsw_deleted: set = PrivateAttr()
+
+    def __init__(self, collection_name: str, dim: Optional[int] = None, path: Optional[str] = None,
+                 similarity_metric: str = "IP", index_type: Optional[str] = None, overwrite: bool = False):
+        super().__init__(
+            collection_name=collection_name,
+            dim=dim,
+            path=os.path.join(path or os.getenv("LOCAL_VECTOR_STORE_PATH") or "./vector_store", collection_name),
+            similarity_metric=similarity_metric.upper(),
+            index_type=(index_type or os.getenv("LOCAL_VECTOR_INDEX") or "flat").lower(),
+        )
+        self._lock = threading.Lock()
+        self._version = -1
+        self._vectors = None
+        self._alive = None
+        self._norms = None
+        self._hnsw = None
+        self._hnsw_rows = 0
+        self._hnsw_deleted = set()
+
+        if overwrite:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+        if not self.exists(collection_name, path):
+            if dim is None:
+                raise ValueError(f"Local collection '{collection_name}' does not exist and no dimension was given")
+            os.makedirs(self.path, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS nodes (
+                    row INTEGER PRIMARY KEY,
+                    node_id TEXT NOT NULL UNIQUE,
+                    ref_doc_id TEXT,
+                    metadata TEXT NOT NULL,
+                    node TEXT NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('rows', '0'), ('version', '0')")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+            self.dim = int(conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()[0])
+
+    @staticmethod
+    def exists(collection_name: str, path: Optional[str] = None) -> bool:
+        path = path or os.getenv("LOCAL_VECTOR_STORE_PATH") or "./vector_store"
+        return os.path.exists(os.path.join(path, collection_name, "nodes.db"))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.path, "nodes.db"), timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE takes the write lock, so appends from several processes never interleave
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+        if self.similarity_metric == "COSINE":
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._write() as conn:
+            rows = int(conn.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()[0])
+            # Drop vectors left behind by a writer that crashed before committing
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(rows * self.dim * 4)
+                f.write(vectors.tobytes())
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO nodes (row, node_id, ref_doc_id, metadata, node) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (rows + i, node.node_id, node.ref_doc_id, json.dumps(node.metadata),
+                     json.dumps(node_to_metadata_dict(node, remove_text=False, flat_metadata=False)))
+                    for i, node in enumerate(nodes)
+                ],
+            )
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'rows'", (str(rows + len(nodes)),))
+
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM nodes WHERE ref_doc_id = ?", (ref_doc_id,))
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None,
+                     **delete_kwargs: Any) -> None:
+        """
+        Deletes nodes by id and/or metadata filters. Their vectors stay in the matrix and are masked out.
+
+        Raises:
+            ValueError: If neither node ids nor filters are given, use `clear` to delete every node
+        """
+        conditions, params = self._filter_sql(filters)
+        if node_ids:
+            conditions.append(f"node_id IN ({','.join('?' * len(node_ids))})")
+            params.extend(node_ids)
+        if not conditions:
+            raise ValueError("Deleting nodes requires node ids or filters")
+
+        with self._write() as conn:
+            conn.execute(f"DELETE FROM nodes WHERE {' AND '.join(conditions)}", params)
+
+    def clear(self) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM nodes")
+            conn.execute("UPDATE meta SET value = '0' WHERE key = 'rows'")
+            # Replaced rather than truncated: readers may still have the old matrix mapped
+            with open(self._vectors_path + ".tmp", "wb"):
+                pass
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        shutil.rmtree(os.path.join(self.path, "hnsw"), ignore_errors=True)
+        with self._lock:
+            self._hnsw, self._hnsw_rows, self._hnsw_deleted = None, 0, set()
+
+    def drop(self):
+        """
+        Deletes the collection from disk
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None) -> List[BaseNode]:
+        conditions, params = self._filter_sql(filters)
+        if node_ids:
+            conditions.append(f"node_id IN ({','.join('?' * len(node_ids))})")
+            params.extend(node_ids)
+
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT node FROM nodes WHERE {' AND '.join(conditions) or '1'}", params).fetchall()
+        return [metadata_dict_to_node(json.loads(node)) for (node,) in rows]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        return self.query_many([query.query_embedding], query.similarity_top_k, query.filters)[0]
+
+    def query_many(self, embeddings: List[List[float]], top_k: int,
+                   filters: Optional[MetadataFilters] = None) -> List[VectorStoreQueryResult]:
+        """
+        Searches many query embeddings at once with a single matrix product
+        """
+        vectors, alive, norms = self._load()
+        if vectors is None or not alive.any():
+            return [VectorStoreQueryResult(nodes=[], similarities=[], ids=[]) for _ in embeddings]
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if self.similarity_metric == "COSINE":
+            queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        if filters is not None and filters.filters:
+            rows = self._filter_rows(filters, len(alive))
+            rows = rows[alive[rows]]
+        elif self.index_type == "hnsw":
+            return [self._to_result(row_ids, scores) for row_ids, scores in zip(*self._hnsw_search(queries, top_k))]
+        else:
+            rows = None
+
+        candidates = vectors if rows is None else vectors[rows]
+        scores = queries @ candidates.T
+        if self.similarity_metric == "L2":
+            # Negated squared distances, so that higher is always better
+            scores = 2 * scores - (norms if rows is None else norms[rows])[None, :] - (queries ** 2).sum(1)[:, None]
+        if rows is None:
+            scores[:, ~alive] = -np.inf
+
+        k = min(top_k, scores.shape[1])
+        results = []
+        for query_scores in scores:
+            best = np.argpartition(-query_scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+            best = best[np.argsort(-query_scores[best])]
+            best = best[np.isfinite(query_scores[best])]
+            row_ids = best if rows is None else rows[best]
+            results.append(self._to_result(row_ids, query_scores[best]))
+        return results
+
+    def _load(self):
+        """
+        Memory-maps the matrix on first use, and again when another writer changed the collection
+        """
+        with self._connect() as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            version = int(meta["version"])
+            if version == self._version:
+                return self._vectors, self._alive, self._norms
+            live_rows = np.array([row for (row,) in conn.execute("SELECT row FROM nodes")], dtype=np.int64)
+
+        with self._lock:
+            rows = int(meta["rows"])
+            vectors = None
+            if rows:
+                vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            alive = np.zeros(rows, dtype=bool)
+            alive[live_rows[live_rows < rows]] = True
+            self._norms = (vectors ** 2).sum(1) if vectors is not None and self.similarity_metric == "L2" else None
+            self._vectors, self._alive, self._version = vectors, alive, version
+            return self._vectors, self._alive, self._norms
+
+    def _hnsw_search(self, queries: np.ndarray, top_k: int):
+        import hnswlib
+
+        vectors, alive, _ = self._load()
+        with self._lock:
+            if self._hnsw is None:
+                space = {"IP": "ip", "COSINE": "ip", "L2": "l2"}[self.similarity_metric]
+                self._hnsw = hnswlib.Index(space=space, dim=self.dim)
+                index_path = os.path.join(self.path, "hnsw", "index.bin")
+                if os.path.exists(index_path):
+                    self._hnsw.load_index(index_path, max_elements=len(alive))
+                    self._hnsw_rows = self._hnsw.get_current_count()
+                else:
+                    self._hnsw.init_index(max_elements=max(len(alive), 1024), M=16, ef_construction=200)
+                self._hnsw.set_ef(int(os.getenv("LOCAL_VECTOR_HNSW_EF") or 64))
+
+            # Insert the rows appended since the graph was last updated, and hide deleted ones
+            if len(alive) > self._hnsw_rows:
+                if len(alive) > self._hnsw.get_max_elements():
+                    self._hnsw.resize_index(2 * len(alive))
+                self._hnsw.add_items(np.asarray(vectors[self._hnsw_rows:]), np.arange(self._hnsw_rows, len(alive)))
+                self._hnsw_rows = len(alive)
+                os.makedirs(os.path.join(self.path, "hnsw"), exist_ok=True)
+                self._hnsw.save_index(os.path.join(self.path, "hnsw", "index.bin"))
+            for row in set(np.flatnonzero(~alive).tolist()) - self._hnsw_deleted:
+                try:
+                    self._hnsw.mark_deleted(row)
+                except RuntimeError:
+                    pass  # Already deleted in the saved graph
+                self._hnsw_deleted.add(row)
+
+            k = min(top_k, int(alive.sum()))
+            labels, distances = self._hnsw.knn_query(queries, k=k)
+
+        scores = -distances if self.similarity_metric == "L2" else 1 - distances
+        return labels, scores
+
+    def _to_result(self, row_ids: np.ndarray, scores: np.ndarray) -> VectorStoreQueryResult:
+        row_ids = [int(row) for row in row_ids]
+        if not row_ids:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        with self._connect() as conn:
+            stored = dict(conn.execute(
+                f"SELECT row, node FROM nodes WHERE row IN ({','.join('?' * len(row_ids))})", row_ids
+            ).fetchall())
+
+        nodes, similarities, ids = [], [], []
+        for row, score in zip(row_ids, scores):
+            if row in stored:
+                node = metadata_dict_to_node(json.loads(stored[row]))
+                nodes.append(node)
+                similarities.append(float(score))
+                ids.append(node.node_id)
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def _filter_rows(self, filters: MetadataFilters, rows: int) -> np.ndarray:
+        conditions, params = self._filter_sql(filters)
+        with self._connect() as conn:
+            matches = [row for (row,) in conn.execute(f"SELECT row FROM nodes WHERE {' AND '.join(conditions)}", params)]
+        matches = np.array(matches, dtype=np.int64)
+        return np.sort(matches[matches < rows])
+
+    @staticmethod
+    def _filter_sql(filters: Optional[MetadataFilters]):
+        """
+        Translates equality and IN filters on metadata keys into SQL conditions
+        """
+        conditions, params = [], []
+        if filters is None:
+            return conditions, params
+
+        if filters.condition not in (None, FilterCondition.AND):
+            raise ValueError("The local vector store only supports AND filters")
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                raise ValueError("The local vector store does not support nested filters")
+            column = f"json_extract(metadata, '$.\"{metadata_filter.key}\"')"
+            if metadata_filter.operator == FilterOperator.EQ:
+                conditions.append(f"{column} = ?")
+                params.append(metadata_filter.value)
+            elif metadata_filter.operator == FilterOperator.IN:
+                conditions.append(f"{column} IN ({','.join('?' * len(metadata_filter.value))})")
+                params.extend(metadata_filter.value)
+            else:
+                raise ValueError(f"The local vector store does not support the {metadata_filter.operator} filter")
+        return conditions, params
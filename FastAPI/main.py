@@ -1,15 +1,103 @@
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import json
+import threading
 from fastapi import FastAPI, Path, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
 from indexing import Indexing_Pipeline 
 from querying import Query_Pipeline 
 import os
 import uvicorn
-from minio import Minio
+from minio.error import S3Error
 from llama_index.core import Settings
+from worker_pool import WorkerPool, PoolFullError
+from jobs import JobStore, IndexingJobQueue
+from bulk_index import pending_objects
+from manifest import IndexManifest
+from embedding_cache import get_embedding_cache
+from answer_cache import get_answer_cache
+from clients import get_client_registry
 
 
-app = FastAPI()
+# Process-wide query pipeline, built once at startup and swapped on reload
+query_pipeline: Optional[Query_Pipeline] = None
+query_pipeline_lock = threading.Lock()
+
+# Separate pools so a slow indexing job never starves queries.
+# The query pool shares the warm pipeline above and therefore always uses threads.
+index_pool = WorkerPool.from_env("index", default_workers=2, default_queue=8)
+query_pool = WorkerPool("query",
+                        max_workers=int(os.getenv("QUERY_POOL_WORKERS") or 8),
+                        max_queue=int(os.getenv("QUERY_POOL_QUEUE_SIZE") or 64))
+
+# Indexing jobs are persisted in SQLite and drained by the indexing pool
+job_store = JobStore()
+job_queue = IndexingJobQueue(job_store, index_pool, workers=int(os.getenv("INDEX_JOB_WORKERS") or 0) or None)
+
+
+def build_query_pipeline(collection_name: Optional[str] = None, only_if_missing: bool = False) -> Query_Pipeline:
+    """
+    Builds a new query pipeline (embedder, LLM client, Milvus connection and retriever)
+    and installs it as the process-wide pipeline used by every request.
+
+    Args:
+        collection_name (Optional[str]): Milvus collection to query. Defaults to MILVUS_COLLECTION_NAME.
+        only_if_missing (bool): Return the installed pipeline instead if there is one, e.g. one built
+            by a concurrent request while this one waited for the lock. Defaults to False.
+
+    Returns:
+        Query_Pipeline: The newly installed query pipeline
+    """
+    global query_pipeline
+
+    with query_pipeline_lock:
+        if only_if_missing and query_pipeline is not None:
+            return query_pipeline
+        new_pipeline = Query_Pipeline(collection_name=collection_name)
+        # Set the embedder and LLM model in the settings
+        Settings.embed_model = new_pipeline.embedder
+        Settings.llm = new_pipeline.llm_model
+        # In-flight requests keep the pipeline they started with
+        query_pipeline = new_pipeline
+
+    print(f"Query pipeline ready on collection '{new_pipeline.collection_name}'")
+    return new_pipeline
+
+
+def get_query_pipeline() -> Query_Pipeline:
+    """
+    Returns the process-wide query pipeline, building it if startup could not
+    (e.g. the collection did not exist yet).
+    """
+    if query_pipeline is not None:
+        return query_pipeline
+
+    try:
+        # Concurrent first requests wait for one build instead of each building a pipeline
+        return build_query_pipeline(only_if_missing=True)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Query pipeline is not available: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        build_query_pipeline()
+    except Exception as e:
+        # Do not block startup, the pipeline is built on the first query instead
+        print(f"Query pipeline not initialized at startup: {e}")
+    job_queue.start()
+    yield
+    job_queue.stop()
+    index_pool.shutdown(wait=False)
+    query_pool.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,38 +112,44 @@ class Document(BaseModel):
     id: str
     text: str
 
-class QueryRequest(BaseModel):
+class RetrievalOptions(BaseModel):
+    # Hybrid retrieval settings, the pipeline defaults are used when not set
+    top_k: Optional[int] = Field(default=None, ge=1, le=100)
+    dense_weight: Optional[float] = Field(default=None, ge=0)
+    sparse_weight: Optional[float] = Field(default=None, ge=0)
+    # Restrict retrieval to some files and pages, filtered by Milvus before the ANN search
+    file_names: Optional[List[str]] = None
+    page_nums: Optional[List[int]] = None
+
+class QueryRequest(RetrievalOptions):
     query: str
 
-minio_client = Minio(
-    endpoint=os.getenv("MINIO_ENDPOINT"),  # MinIO endpoint (e.g., 'localhost:9000')
-    access_key=os.getenv("MINIO_ACCESS_KEY"),  # MinIO access key
-    secret_key=os.getenv("MINIO_SECRET_KEY"),  # MinIO secret key
-    secure=False  # Disable SSL for local MinIO; set to True for HTTPS endpoints
-)
+class BatchQueryRequest(RetrievalOptions):
+    queries: List[str]
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+
+class ReloadRequest(BaseModel):
+    collection_name: Optional[str] = None
+
+# MinIO client shared with the pipelines, over one sized connection pool (MINIO_POOL_SIZE)
+minio_client = get_client_registry().minio()
 
 bucket_name = os.getenv("MINIO_BUCKET_NAME")  # MinIO bucket name
 
-# Background task for document indexing
-def index_document_in_background(file_path):
-    try: 
-        indexing_pipeline = Indexing_Pipeline()
-        index = indexing_pipeline.run([file_path])
-        return index
-    
-    except Exception as e:
-        print(f"Error indexing document: {e}") 
+def delete_indexes_in_background(file_name):
+    indexing_pipeline = Indexing_Pipeline()
+    return indexing_pipeline.delete_milvus_indexes_using_filename(file_name)
+
+
+def retrieval_options(request: RetrievalOptions) -> dict:
+    return {key: getattr(request, key) for key in RetrievalOptions.model_fields}
 
 
 # Helper function for querying
-def query_pipeline_execution(query: str):
+def query_pipeline_execution(query: str, **retrieval_options):
+    pipeline = get_query_pipeline()
     try:
-        query_pipeline= Query_Pipeline() 
-        # Set the embedder and LLM model in the settings
-        Settings.embed_model = query_pipeline.embedder
-        Settings.llm = query_pipeline.llm_model
-        response = query_pipeline.run(query)
-        return response
+        return pipeline.answer(query, **retrieval_options)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying documents: {e}")
 
@@ -64,39 +158,188 @@ def query_pipeline_execution(query: str):
 async def index_document(file_name: str):
     try:
         print(f"Attempting to retrieve file from MinIO: {file_name}")
-        response = minio_client.get_object(bucket_name, file_name)
-        
-        if not response:
-            raise HTTPException(status_code=404, detail=f"Document '{file_name}' not found in MinIO")
+        await run_in_threadpool(minio_client.stat_object, bucket_name, file_name)
 
-        index = index_document_in_background(file_name)
-        return {"index": index}
+        job = await run_in_threadpool(job_queue.enqueue, file_name)
+        return {"job_id": job["id"], "status": job["status"]}
     
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise HTTPException(status_code=404, detail=f"Document '{file_name}' not found in MinIO")
+        raise HTTPException(status_code=500, detail=f"Error indexing document: {e}")
+
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
     except Exception as e:
         print(f"Error occurred: {e}")  # Log the error
         raise HTTPException(status_code=500, detail=f"Error indexing document: {e}")
-    
-    finally:
-        if 'response' in locals():
-            response.close()
-            response.release_conn()
+
+@app.post("/index/prefix")
+async def index_prefix(prefix: str = Query(...)):
+    """
+    Queues an indexing job for every object under the bucket prefix not yet indexed with its current ETag.
+    Queued jobs survive a restart; use bulk_index.py to backfill more objects than the job queue holds.
+    """
+    try:
+        pending, skipped = await run_in_threadpool(
+            pending_objects, minio_client, bucket_name, prefix, IndexManifest(), os.getenv("MILVUS_COLLECTION_NAME")
+        )
+        job_ids = await run_in_threadpool(job_queue.enqueue_many, pending)
+        return {"prefix": prefix, "objects": len(pending) + skipped, "skipped": skipped, "queued": len(job_ids),
+                "already_queued": len(pending) - len(job_ids)}
+
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    except Exception as e:
+        print(f"Error occurred: {e}")  # Log the error
+        raise HTTPException(status_code=500, detail=f"Error indexing prefix: {e}")
 
 # Route to handle document querying
 @app.post("/query")
 async def query_documents(query: QueryRequest):
     try:
-        response = query_pipeline_execution(query.query) 
-        return {"response": response}
+        result = await query_pool.run(query_pipeline_execution, query.query, **retrieval_options(query))
+        return {"response": result["response"], "stats": result["stats"]}
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving response: {e}")
 
+
+# Route to answer many queries at once, e.g. for evaluation runs
+@app.post("/query/batch")
+async def query_documents_batch(request: BatchQueryRequest):
+    max_batch_size = int(os.getenv("QUERY_BATCH_MAX_SIZE") or 256)
+    if len(request.queries) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"At most {max_batch_size} queries per batch")
+
+    try:
+        pipeline = await run_in_threadpool(get_query_pipeline)
+        results = await query_pool.run(pipeline.run_batch, request.queries, request.max_concurrency,
+                                       **retrieval_options(request))
+        return {"results": results}
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving responses: {e}")
+
+
+def sse_events(events):
+    """
+    Formats query pipeline events as Server-Sent Events, reporting failures as an "error" event
+    """
+    try:
+        for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    except Exception as e:
+        print(f"Error streaming response: {e}")
+        yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+
+# Route to stream the response to a query as Server-Sent Events
+@app.post("/query/stream")
+async def query_documents_stream(query: QueryRequest):
+    pipeline = await run_in_threadpool(get_query_pipeline)
+    # The sync generator is iterated on the query pool, holding one of its slots for the whole stream
+    try:
+        events = query_pool.stream(sse_events(pipeline.stream(query.query, **retrieval_options(query))))
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str = Path(...)):
+    """
+    Returns the status of an indexing job and its progress by stage (fetch, parse, chunk, embed, upsert)
+    """
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+
+@app.get("/metrics/pools")
+async def pool_metrics():
+    """
+    Returns queue depth and task counters of the indexing and query worker pools
+    """
+    return {
+        "index": index_pool.metrics(),
+        "query": query_pool.metrics(),
+        "jobs": await run_in_threadpool(job_store.count_by_status),
+    }
+
+
+@app.get("/metrics/embeddings")
+async def embedding_metrics():
+    """
+    Returns the hit and miss counters of the embedding cache shared by indexing and querying
+    """
+    cache = get_embedding_cache()
+    return {"cache": cache.stats() if cache else None}
+
+
+@app.get("/metrics/answers")
+async def answer_metrics():
+    """
+    Returns the hit rate and eviction counters of the semantic answer cache
+    """
+    cache = get_answer_cache()
+    return {"cache": cache.stats() if cache else None}
+
+
+@app.get("/metrics/clients")
+async def client_metrics():
+    """
+    Returns the utilisation of the MinIO connection pool and the Milvus connection counters
+    """
+    return get_client_registry().stats()
+
+
+@app.get("/health")
+async def health():
+    """
+    Checks that Milvus and the MinIO bucket answer, reconnecting to Milvus if needed
+    """
+    status = await run_in_threadpool(get_client_registry().health, bucket_name)
+    if not status["ok"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+
+@app.post("/admin/reload")
+async def reload_query_pipeline(request: Optional[ReloadRequest] = None):
+    """
+    Rebuilds the query pipeline, picking up changes to the .env file
+    (models, collection) or the collection passed in the request body.
+    """
+    try:
+        load_dotenv(override=True)
+        collection_name = request.collection_name if request else None
+        pipeline = await run_in_threadpool(build_query_pipeline, collection_name)
+        return {"status": "success", "collection_name": pipeline.collection_name}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reloading query pipeline: {e}")
+
     
 @app.delete("/delete")
 async def delete_indexes(file_name: str = Query(...)):
     try:
-        indexing_pipeline = Indexing_Pipeline()
-        response = indexing_pipeline.delete_milvus_indexes_using_filename(file_name)
+        response = await index_pool.run(delete_indexes_in_background, file_name)
         return response
+    except PoolFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting indexes from milvus: {e}")
     
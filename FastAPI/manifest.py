@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IndexManifest():
+
+    """Record of what has been indexed into each Milvus collection: the MinIO ETag of every file,
+       and for every page the hash of its text and the Milvus primary keys of its chunks.
+       Used to skip unchanged files and to re-embed only the pages that changed.
+       Every change to a collection also bumps its version, which invalidates cached answers.
+
+    Args:
+        db_path (Optional[str], optional): Path to the SQLite database. Defaults to INDEX_MANIFEST_PATH or "./index_manifest.db".
+
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("INDEX_MANIFEST_PATH") or "./index_manifest.db"
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    collection_name TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    indexed_at REAL NOT NULL,
+                    PRIMARY KEY (collection_name, file_name)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    collection_name TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    page_num INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    node_ids TEXT NOT NULL,
+                    PRIMARY KEY (collection_name, file_name, page_num)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS collections (
+                    collection_name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, collection_name: str):
+        conn.execute(
+            """INSERT INTO collections (collection_name, version) VALUES (?, 1)
+               ON CONFLICT (collection_name) DO UPDATE SET version = version + 1""",
+            (collection_name,),
+        )
+
+    def get_version(self, collection_name: str) -> int:
+        """
+        Returns the version of a collection, bumped whenever files are indexed into or deleted from it
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version FROM collections WHERE collection_name = ?", (collection_name,)
+            ).fetchone()
+        return row["version"] if row else 0
+
+    def file_etags(self, collection_name: str) -> dict:
+        """
+        Returns the ETag recorded for every file of a collection ({file_name: etag})
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT file_name, etag FROM files WHERE collection_name = ?", (collection_name,)
+            ).fetchall()
+        return {row["file_name"]: row["etag"] for row in rows}
+
+    def get_file(self, collection_name: str, file_name: str) -> Optional[dict]:
+        """
+        Returns the ETag and pages ({page_num: {"text_hash", "node_ids"}}) recorded for a file
+        """
+        with self._connect() as conn:
+            file_row = conn.execute(
+                "SELECT etag, indexed_at FROM files WHERE collection_name = ? AND file_name = ?",
+                (collection_name, file_name),
+            ).fetchone()
+            if file_row is None:
+                return None
+            page_rows = conn.execute(
+                "SELECT page_num, text_hash, node_ids FROM pages WHERE collection_name = ? AND file_name = ?",
+                (collection_name, file_name),
+            ).fetchall()
+
+        return {
+            "etag": file_row["etag"],
+            "indexed_at": file_row["indexed_at"],
+            "pages": {
+                row["page_num"]: {"text_hash": row["text_hash"], "node_ids": json.loads(row["node_ids"])}
+                for row in page_rows
+            },
+        }
+
+    def record_file(self, collection_name: str, file_name: str, etag: str, pages: Dict[int, dict]):
+        """
+        Replaces the record of a file with its new ETag and pages
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (collection_name, file_name, etag, indexed_at) VALUES (?, ?, ?, ?)",
+                (collection_name, file_name, etag, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM pages WHERE collection_name = ? AND file_name = ?", (collection_name, file_name)
+            )
+            conn.executemany(
+                "INSERT INTO pages (collection_name, file_name, page_num, text_hash, node_ids) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (collection_name, file_name, page_num, page["text_hash"], json.dumps(page["node_ids"]))
+                    for page_num, page in pages.items()
+                ],
+            )
+            self._bump_version(conn, collection_name)
+
+    def delete_file(self, collection_name: str, file_name: str) -> List[str]:
+        """
+        Removes the record of a file and returns the Milvus primary keys that were recorded for it
+        """
+        indexed = self.get_file(collection_name, file_name)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE collection_name = ? AND file_name = ?", (collection_name, file_name))
+            conn.execute("DELETE FROM pages WHERE collection_name = ? AND file_name = ?", (collection_name, file_name))
+            self._bump_version(conn, collection_name)
+
+        if indexed is None:
+            return []
+        return [node_id for page in indexed["pages"].values() for node_id in page["node_ids"]]
+
+    def delete_collection(self, collection_name: str):
+        """
+        Forgets everything indexed into a collection, e.g. after it was dropped
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files WHERE collection_name = ?", (collection_name,))
+            conn.execute("DELETE FROM pages WHERE collection_name = ?", (collection_name,))
+            self._bump_version(conn, collection_name)
@@ -0,0 +1,64 @@
+import json
+import os
+from typing import Optional
+
+
+# Build parameters of each supported index type, overridden by MILVUS_INDEX_PARAMS
+DEFAULT_INDEX_PARAMS = {
+    "FLAT": {},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024},
+    "IVF_PQ": {"nlist": 1024, "m": 16, "nbits": 8},
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "AUTOINDEX": {},
+}
+
+# Search parameters of each index type, overridden by MILVUS_SEARCH_PARAMS
+DEFAULT_SEARCH_PARAMS = {
+    "FLAT": {},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16},
+    "IVF_PQ": {"nprobe": 16},
+    "HNSW": {"ef": 64},
+    "AUTOINDEX": {},
+}
+
+
+def index_type(value: Optional[str] = None) -> str:
+    """
+    Returns the vector index type, from MILVUS_INDEX_TYPE by default (FLAT if unset)
+
+    Raises:
+        ValueError: If the index type is not supported
+    """
+    value = (value or os.getenv("MILVUS_INDEX_TYPE") or "FLAT").upper()
+    if value not in DEFAULT_INDEX_PARAMS:
+        raise ValueError(f"Unsupported Milvus index type: {value}. Choose from {', '.join(DEFAULT_INDEX_PARAMS)}")
+    return value
+
+
+def similarity_metric(value: Optional[str] = None) -> str:
+    """
+    Returns the similarity metric, from MILVUS_METRIC_TYPE by default (IP if unset)
+    """
+    return (value or os.getenv("MILVUS_METRIC_TYPE") or "IP").upper()
+
+
+def index_config(index: Optional[str] = None, params: Optional[dict] = None) -> dict:
+    """
+    Returns the index_config of MilvusVectorStore: the index type and its build parameters,
+    e.g. MILVUS_INDEX_TYPE=HNSW and MILVUS_INDEX_PARAMS='{"M": 32, "efConstruction": 256}'
+    """
+    index = index_type(index)
+    overrides = params if params is not None else json.loads(os.getenv("MILVUS_INDEX_PARAMS") or "{}")
+    return {"index_type": index, **DEFAULT_INDEX_PARAMS[index], **overrides}
+
+
+def search_config(index: Optional[str] = None, params: Optional[dict] = None) -> dict:
+    """
+    Returns the search_config of MilvusVectorStore for the index type,
+    e.g. MILVUS_SEARCH_PARAMS='{"nprobe": 32}' for IVF indexes or '{"ef": 128}' for HNSW
+    """
+    index = index_type(index)
+    overrides = params if params is not None else json.loads(os.getenv("MILVUS_SEARCH_PARAMS") or "{}")
+    return {"params": {**DEFAULT_SEARCH_PARAMS[index], **overrides}}
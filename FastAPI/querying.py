@@ -1,5 +1,8 @@
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 import os
+import time
 
 from pydantic import BaseModel, Field
 from llama_index.core import PromptTemplate
@@ -7,7 +10,11 @@ from llama_index.core.query_engine import CustomQueryEngine
 from llama_index.core.retrievers import BaseRetriever
 from llama_index.core import get_response_synthesizer
 from llama_index.core.response_synthesizers import BaseSynthesizer
+from llama_index.core.llms import LLM
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
 from llama_index.core import VectorStoreIndex
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
 
 from llama_index.embeddings.nvidia import NVIDIAEmbedding
 from llama_index.llms.nvidia import NVIDIA
@@ -15,7 +22,17 @@ from llama_index.llms.azure_openai import AzureOpenAI
 from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
 
 from llama_index.vector_stores.milvus import MilvusVectorStore
-from pymilvus import connections, utility
+from llama_index.vector_stores.milvus.utils import parse_standard_filters
+from embedding import BatchedEmbedding, estimate_tokens
+from answer_cache import get_answer_cache
+from manifest import IndexManifest
+from sparse_index import SparseIndex, reciprocal_rank_fusion
+from local_vector_store import LocalVectorStore, vector_store_backend
+from reranker import CrossEncoderReranker
+from context_assembler import ContextAssembler
+import milvus_settings
+from pymilvus import utility
+from clients import get_client_registry
 
 
 load_dotenv()
@@ -31,20 +48,44 @@ class Query_Pipeline():
         model_name (Optional[str], optional): Name of the model (E.g. gpt-35-turbo, mistralai/mistral-7b-instruct-v0.2). Defaults to "mistralai/mistral-7b-instruct-v0.2".
     
     """
-    def __init__(self):
+    def __init__(self, collection_name: Optional[str] = None):
         self.model_host = os.getenv("MODEL_HOST")
         self.milvus_host_IP = os.getenv("MILVUS_HOST")
         self.milvus_port = os.getenv("MILVUS_PORT")
-        self.collection_name = os.getenv("MILVUS_COLLECTION_NAME")
+        self.collection_name = collection_name or os.getenv("MILVUS_COLLECTION_NAME")
+        self.similarity_top_k = int(os.getenv("RETRIEVAL_TOP_K") or 5)
+        self.sparse_index = SparseIndex()
+        # Search parameters of the collection's index type (MILVUS_INDEX_TYPE, MILVUS_SEARCH_PARAMS, MILVUS_METRIC_TYPE)
+        self.search_config = milvus_settings.search_config()
+        self.similarity_metric = milvus_settings.similarity_metric()
         self.embedder = self.initialize_embedder()  
-        self.milvus_store = self.connect_to_milvus_store()
+        # Milvus, or the in-process store with VECTOR_STORE_BACKEND=local
+        self.vector_store_backend = vector_store_backend()
+        self.milvus_store = self.connect_to_local_store() if self.vector_store_backend == "local" else self.connect_to_milvus_store()
         self.llm_model = self.initialize_llm_model()
+        # Optional cross-encoder rerank of over-retrieved candidates (RERANK_MODEL_PATH)
+        self.reranker = CrossEncoderReranker.from_env(top_n=self.similarity_top_k)
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES") or 20)
+        # Deduplicates and merges the kept chunks into a context of CONTEXT_TOKEN_BUDGET tokens
+        self.context_assembler = ContextAssembler()
+        # Built once and reused by every query served by this pipeline
+        self.retriever = self.initalize_retriever()
+        self.query_engine = self.initialize_query_engine()
+        # Answers to the same or near-identical questions are reused until the collection changes
+        self.answer_cache = get_answer_cache()
+        self.manifest = IndexManifest()
 
     def initialize_embedder(self):
+        """
+        Initializes the embedder based on the model host (NVIDIA or Azure),
+        backed by the embedding cache shared with the indexing pipeline
+        """
         if self.model_host == "NVIDIA":
+            base_url = os.getenv('EMBEDDING_BASE_URL')
             embedder = NVIDIAEmbedding(
                 model=os.getenv('EMBEDDING_MODEL'),
-                truncate="END")
+                truncate="END",
+                **({"base_url": base_url} if base_url else {}))
 
         elif self.model_host == "AZURE":
             embedder = AzureOpenAIEmbedding(
@@ -55,7 +96,7 @@ class Query_Pipeline():
                 api_key=os.getenv('API_KEY')
             )  
 
-        return embedder
+        return BatchedEmbedding.from_env(embedder)
     
     def connect_to_milvus_store(self):
         """
@@ -65,16 +106,19 @@ class Query_Pipeline():
             str: Message indicating the status of the connection
         """
         
-        # Establish a connection to Milvus
-        connections.connect(host=self.milvus_host_IP, port=self.milvus_port)
+        # Shared connection to Milvus, reconnected if it stopped answering
+        clients = get_client_registry()
+        alias = clients.milvus()
         
         # Check if the collection already exists
-        if utility.has_collection(self.collection_name):
+        if utility.has_collection(self.collection_name, using=alias):
             print(f"Milvus collection '{self.collection_name}' exists. Querying from collection.")
             milvus_store = MilvusVectorStore(
                 collection_name=self.collection_name,
-                uri=f"http://{self.milvus_host_IP}:{self.milvus_port}/",
-                overwrite=False  # Reuse the existing collection without overwriting
+                uri=clients.milvus_uri,
+                overwrite=False,  # Reuse the existing collection without overwriting
+                search_config=self.search_config,
+                similarity_metric=self.similarity_metric,
             )
             
             return milvus_store
@@ -82,11 +126,28 @@ class Query_Pipeline():
         else:
             raise Exception(f"Milvus collection '{self.collection_name}' does not exist. Please index documents before querying.")
         
+    def connect_to_local_store(self):
+        """
+        Opens an existing collection of the local vector store
+        """
+        if not LocalVectorStore.exists(self.collection_name):
+            raise Exception(f"Local collection '{self.collection_name}' does not exist. Please index documents before querying.")
+
+        print(f"Local collection '{self.collection_name}' exists. Querying from collection.")
+        return LocalVectorStore(collection_name=self.collection_name, similarity_metric=self.similarity_metric)
+
     def initalize_retriever(self):
+        """
+        Builds the hybrid retriever: dense Milvus search fused with the local BM25 index
+        """
         milvus_store = self.milvus_store
-        index = VectorStoreIndex.from_vector_store(vector_store=milvus_store)
-        retriever = index.as_retriever(
-            similarity_top_k=5,
+        # The pipeline's own embedder, so building it does not depend on the global Settings
+        index = VectorStoreIndex.from_vector_store(vector_store=milvus_store, embed_model=self.embedder)
+        retriever = HybridRetriever(
+            index=index,
+            sparse_index=self.sparse_index,
+            collection_name=self.collection_name,
+            top_k=self.similarity_top_k,
         )
 
         return retriever
@@ -109,17 +170,10 @@ class Query_Pipeline():
         return llm_model
     
     
-    def run(self, query:str):
-        
-        """Run the query pipeline.
-
-        Args:
-            query (str): Query
-
-        Returns:
-            response: Response to query
+    def initialize_query_engine(self):
+        """
+        Builds the RAG query engine on top of the retriever and LLM of this pipeline
         """
-
         qa_prompt = PromptTemplate( "You are a helpful chatbot assisting a user with a question.\n"
                                 "If the user asks a question that you do not have the context to, say I don't have the required context.\n"
                                 "Context information is below.\n"
@@ -132,42 +186,391 @@ class Query_Pipeline():
                                 "Answer: "
                                 )
         
-        
         # Set up synthesizer, LLM, and query engine
-        retriever = self.initalize_retriever()
-        synthesizer = get_response_synthesizer(response_mode="compact")
-        llm = self.llm_model
+        synthesizer = get_response_synthesizer(response_mode="compact", llm=self.llm_model)
 
         query_engine = RAGStringQueryEngine(
-            retriever=retriever,
+            retriever=self.retriever,
             response_synthesizer=synthesizer,
-            llm=llm,
+            llm=self.llm_model,
             qa_prompt=qa_prompt,
+            reranker=self.reranker,
+            rerank_candidates=self.rerank_candidates,
+            context_assembler=self.context_assembler,
         )
 
-        response = query_engine.custom_query(query)
+        return query_engine
+    
+    def run(self, query:str, **retrieval_options):
+        
+        """Run the query pipeline.
+           A cached answer is returned when a similar enough query was answered from the current
+           version of the collection.
+
+        Args:
+            query (str): Query
+            **retrieval_options: top_k, dense_weight, sparse_weight, file_names and page_nums of the hybrid retriever for this query
+
+        Returns:
+            response: Response to query
+        """
+        return self.answer(query, **retrieval_options)["response"]
+
+    def answer(self, query:str, **retrieval_options) -> dict:
+        """Run the query pipeline, reporting how the answer was produced.
+
+        Args:
+            query (str): Query
+            **retrieval_options: top_k, dense_weight, sparse_weight, file_names and page_nums of the hybrid retriever for this query
+
+        Returns:
+            dict: The "response" and its "stats": retrieval, rerank and generation latencies,
+                candidates, duplicates removed and passages merged, context tokens and tokens saved,
+                and whether the answer was cached
+        """
+        retrieval_options = {key: value for key, value in retrieval_options.items() if value is not None}
+        # Answers are only cached for the default retrieval settings
+        if self.answer_cache is None or retrieval_options:
+            return self.query_engine.query_with_stats(query, **retrieval_options)
+
+        start = time.perf_counter()
+        version = self.manifest.get_version(self.collection_name)
+        embedding = self.embedder.get_query_embedding(query)
+        response = self.answer_cache.get(embedding, self.collection_name, version)
+        if response is not None:
+            return {"response": response, "stats": {"cached": True, "total_ms": round((time.perf_counter() - start) * 1000, 1)}}
+
+        # Retrieval reuses the embedding of the cache lookup instead of embedding the query again
+        result = self.query_engine.query_with_stats(query, embedding=embedding)
+        self.answer_cache.put(embedding, result["response"], self.collection_name, version)
+        return result
+
+    def search_many(self, embeddings: List[List[float]], top_k: Optional[int] = None,
+                    filters: Optional[MetadataFilters] = None) -> List[List[NodeWithScore]]:
+        """
+        Retrieves the nodes of many query embeddings with a single multi-vector search
+
+        Args:
+            embeddings (List[List[float]]): Query embeddings
+            top_k (Optional[int], optional): Nodes per query. Defaults to the pipeline's similarity_top_k.
+            filters (Optional[MetadataFilters], optional): Metadata filters applied before the ANN search
+
+        Returns:
+            List[List[NodeWithScore]]: The retrieved nodes of each query, in order
+        """
+        if isinstance(self.milvus_store, LocalVectorStore):
+            results = self.milvus_store.query_many(embeddings, top_k or self.similarity_top_k, filters)
+            return [
+                [NodeWithScore(node=node, score=score) for node, score in zip(result.nodes, result.similarities)]
+                for result in results
+            ]
+
+        results = self.milvus_store.client.search(
+            collection_name=self.collection_name,
+            data=embeddings,
+            filter=parse_standard_filters(filters)[1] if filters else "",
+            limit=top_k or self.similarity_top_k,
+            output_fields=["*"],
+            search_params=self.milvus_store.search_config,
+            anns_field=self.milvus_store.embedding_field,
+        )
+
+        text_key = self.milvus_store.text_key
+        return [
+            [NodeWithScore(node=node_from_hit(hit, text_key), score=hit["distance"]) for hit in hits]
+            for hits in results
+        ]
+
+    def run_batch(self, queries: List[str], max_concurrency: Optional[int] = None, **retrieval_options) -> List[dict]:
+        """Run the query pipeline on many queries at once.
+           The queries are embedded in one batch and searched with one Milvus request,
+           fused with the BM25 results of each query, then answered by the LLM with bounded concurrency.
+
+        Args:
+            queries (List[str]): Queries
+            max_concurrency (Optional[int], optional): Concurrent LLM completions. Defaults to QUERY_BATCH_CONCURRENCY or 4.
+            **retrieval_options: top_k, dense_weight, sparse_weight, file_names and page_nums of the hybrid retriever for these queries
+
+        Returns:
+            List[dict]: For each query in order, its "response", or its "error" if it failed
+        """
+        max_concurrency = max_concurrency or int(os.getenv("QUERY_BATCH_CONCURRENCY") or 4)
+        retrieval_options = {key: value for key, value in retrieval_options.items() if value is not None}
+        answer_cache = None if retrieval_options else self.answer_cache
+        results = [{"query": query} for query in queries]
+
+        embeddings = self.embedder.get_query_embeddings(queries)
+
+        # Queries answered from the current collection version are served from the answer cache
+        version = self.manifest.get_version(self.collection_name)
+        pending = []
+        for i, embedding in enumerate(embeddings):
+            cached = answer_cache.get(embedding, self.collection_name, version) if answer_cache else None
+            if cached is None:
+                pending.append(i)
+            else:
+                results[i]["response"] = cached
+
+        if not pending:
+            return results
+
+        retriever = self.retriever
+        top_k = retrieval_options.get("top_k", retriever.top_k)
+        # With a reranker, candidates are over-retrieved and the reranker keeps top_k of them
+        retrieve_k = self.rerank_candidates if self.reranker else top_k
+        filters = metadata_filters(retrieval_options.get("file_names"), retrieval_options.get("page_nums"))
+        dense = self.search_many([embeddings[i] for i in pending], top_k=retrieve_k * retriever.candidate_multiplier,
+                                 filters=filters)
+        retrieved = [
+            retriever.fuse(dense_nodes, queries[i], **{**retrieval_options, "top_k": retrieve_k})
+            for i, dense_nodes in zip(pending, dense)
+        ]
+
+        def answer(i: int, nodes: List[NodeWithScore]):
+            try:
+                if self.reranker is not None:
+                    nodes = self.reranker.rerank(queries[i], nodes, top_n=top_k)
+                response = self.query_engine.answer(queries[i], nodes)
+                results[i]["response"] = response
+                if answer_cache is not None:
+                    answer_cache.put(embeddings[i], response, self.collection_name, version)
+            except Exception as e:
+                results[i]["error"] = str(e)
 
-        return response
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="query-batch") as executor:
+            list(executor.map(answer, pending, retrieved))
+
+        return results
+
+    def stream(self, query:str, **retrieval_options) -> Iterator[dict]:
+        """Run the query pipeline, streaming the answer as it is generated.
+
+        Args:
+            query (str): Query
+            **retrieval_options: top_k, dense_weight, sparse_weight, file_names and page_nums of the hybrid retriever for this query
+
+        Yields:
+            dict: Events with an "event" name and "data": the retrieved sources first,
+                then each generated token, then timing stats
+        """
+        retrieval_options = {key: value for key, value in retrieval_options.items() if value is not None}
+        return self.query_engine.stream_query(query, **retrieval_options)
         
 
+def metadata_filters(file_names: Optional[List[str]] = None, page_nums: Optional[List[int]] = None) -> Optional[MetadataFilters]:
+    """
+    Returns the filters restricting retrieval to some files and pages, or None to search everything
+    """
+    filters = [
+        MetadataFilter(key=key, value=values, operator=FilterOperator.IN)
+        for key, values in (("file_name", file_names), ("page_num", page_nums)) if values
+    ]
+    return MetadataFilters(filters=filters) if filters else None
+
+
+class HybridRetriever(BaseRetriever):
+
+    """Retriever fusing dense Milvus search with the local BM25 index by weighted reciprocal-rank fusion.
+       Each side retrieves `candidate_multiplier` times more nodes than are returned.
+
+    Args:
+        index (VectorStoreIndex): Index over the Milvus collection
+        sparse_index (SparseIndex): BM25 index of the same collection
+        collection_name (str): Name of the collection
+        top_k (int): Nodes returned. Defaults to 5.
+        dense_weight (Optional[float]): Weight of the dense ranking. Defaults to HYBRID_DENSE_WEIGHT or 1.0.
+        sparse_weight (Optional[float]): Weight of the BM25 ranking, 0 for dense only. Defaults to HYBRID_SPARSE_WEIGHT or 1.0.
+        rrf_k (Optional[int]): Rank constant of the fusion. Defaults to HYBRID_RRF_K or 60.
+
+    """
+
+    def __init__(self, index: VectorStoreIndex, sparse_index: SparseIndex, collection_name: str, top_k: int = 5,
+                 dense_weight: Optional[float] = None, sparse_weight: Optional[float] = None, rrf_k: Optional[int] = None,
+                 candidate_multiplier: int = 3):
+        super().__init__()
+        self.index = index
+        self.sparse_index = sparse_index
+        self.collection_name = collection_name
+        self.top_k = top_k
+        self.dense_weight = dense_weight if dense_weight is not None else float(os.getenv("HYBRID_DENSE_WEIGHT") or 1.0)
+        self.sparse_weight = sparse_weight if sparse_weight is not None else float(os.getenv("HYBRID_SPARSE_WEIGHT") or 1.0)
+        self.rrf_k = rrf_k or int(os.getenv("HYBRID_RRF_K") or 60)
+        self.candidate_multiplier = candidate_multiplier
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retrieve_with(query_bundle.query_str, embedding=query_bundle.embedding)
+
+    def retrieve_with(self, query_str: str, top_k: Optional[int] = None, dense_weight: Optional[float] = None,
+                      sparse_weight: Optional[float] = None, file_names: Optional[List[str]] = None,
+                      page_nums: Optional[List[int]] = None, embedding: Optional[List[float]] = None) -> List[NodeWithScore]:
+        """
+        Retrieves with per-request settings, falling back to the retriever's defaults.
+        File and page filters are applied by Milvus before the ANN search.
+        The query is only embedded if its `embedding` is not given.
+        """
+        top_k = top_k or self.top_k
+        dense_weight = self.dense_weight if dense_weight is None else dense_weight
+        dense = []
+        if dense_weight:
+            retriever = self.index.as_retriever(
+                similarity_top_k=top_k * self.candidate_multiplier,
+                filters=metadata_filters(file_names, page_nums),
+            )
+            dense = retriever.retrieve(QueryBundle(query_str, embedding=embedding))
+        return self.fuse(dense, query_str, top_k=top_k, dense_weight=dense_weight, sparse_weight=sparse_weight,
+                         file_names=file_names, page_nums=page_nums)
+
+    def fuse(self, dense: List[NodeWithScore], query_str: str, top_k: Optional[int] = None,
+             dense_weight: Optional[float] = None, sparse_weight: Optional[float] = None,
+             file_names: Optional[List[str]] = None, page_nums: Optional[List[int]] = None) -> List[NodeWithScore]:
+        """
+        Fuses dense results of a query with its BM25 results, scoring nodes by their fused score
+        """
+        top_k = top_k or self.top_k
+        dense_weight = self.dense_weight if dense_weight is None else dense_weight
+        sparse_weight = self.sparse_weight if sparse_weight is None else sparse_weight
+
+        sparse = []
+        if sparse_weight:
+            sparse = self.sparse_index.search(self.collection_name, query_str, top_k * self.candidate_multiplier,
+                                              file_names=file_names, page_nums=page_nums)
+
+        nodes = {result.node.node_id: result.node for result in dense}
+        for hit in sparse:
+            nodes.setdefault(hit["node_id"], TextNode(id_=hit["node_id"], text=hit["text"], metadata=hit["metadata"]))
+
+        scores = reciprocal_rank_fusion(
+            [[result.node.node_id for result in dense], [hit["node_id"] for hit in sparse]],
+            [dense_weight, sparse_weight],
+            k=self.rrf_k,
+        )
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in list(scores.items())[:top_k]]
+
+
+def node_from_hit(hit: dict, text_key: str) -> TextNode:
+    """
+    Builds the node of a Milvus search hit from its fields: the node serialised by the vector store
+    in "_node_content", with its text from the text field
+    """
+    entity = hit["entity"]
+    if "_node_content" in entity:
+        return metadata_dict_to_node(entity, text=entity.get(text_key))
+    metadata = {key: value for key, value in entity.items() if key != text_key and not isinstance(value, list)}
+    return TextNode(id_=str(hit["id"]), text=entity.get(text_key) or "", metadata=metadata)
+
+
+def elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def source_metadata(node: NodeWithScore) -> dict:
+    """
+    Returns the id, score and metadata of a retrieved node
+    """
+    return {"node_id": node.node.node_id, "score": node.score, **node.node.metadata}
+
+
 class RAGStringQueryEngine(CustomQueryEngine, BaseModel):
     """Custom RAG String Query Engine."""
 
     retriever: BaseRetriever = Field(...)
     response_synthesizer: BaseSynthesizer = Field(...)
-    llm: AzureOpenAI = Field(...)
+    llm: LLM = Field(...)
     qa_prompt: PromptTemplate = Field(...)
+    reranker: Optional[CrossEncoderReranker] = None
+    rerank_candidates: int = 20
+    context_assembler: Optional[ContextAssembler] = None
 
-    def custom_query(self, query_str: str) -> str:
+    def retrieve(self, query_str: str, **retrieval_options) -> List[NodeWithScore]:
         # Retrieve relevant nodes
-        nodes = self.retriever.retrieve(query_str)
-        
+        if retrieval_options:
+            return self.retriever.retrieve_with(query_str, **retrieval_options)
+        return self.retriever.retrieve(query_str)
+
+    def format_prompt(self, query_str: str, nodes: List[NodeWithScore]) -> Tuple[str, dict]:
         # Generate context string from nodes
-        context_str = "\n\n".join([n.node.get_content() for n in nodes])
-        
+        if self.context_assembler is not None:
+            context_str, context_stats = self.context_assembler.assemble(nodes)
+        else:
+            context_str = "\n\n".join([n.node.get_content() for n in nodes])
+            context_stats = {"chunks": len(nodes), "context_tokens": estimate_tokens(context_str) if nodes else 0}
+
+        return self.qa_prompt.format(context_str=context_str, query_str=query_str), context_stats
+
+    def answer(self, query_str: str, nodes: List[NodeWithScore]) -> str:
+        return self.answer_with_stats(query_str, nodes)[0]
+
+    def answer_with_stats(self, query_str: str, nodes: List[NodeWithScore]) -> Tuple[str, dict]:
         # Format prompt and query LLM
-        formatted_prompt = self.qa_prompt.format(context_str=context_str, query_str=query_str)
+        formatted_prompt, context_stats = self.format_prompt(query_str, nodes)
         response = self.llm.complete(prompt=formatted_prompt)
         
-        return str(response)
+        return str(response), context_stats
+
+    def retrieve_and_rerank(self, query_str: str, **retrieval_options) -> Tuple[List[NodeWithScore], dict]:
+        """
+        Retrieves the nodes of the prompt, over-retrieving candidates for the reranker when there is one
+        """
+        start = time.perf_counter()
+        if self.reranker is None:
+            nodes = self.retrieve(query_str, **retrieval_options)
+            return nodes, {"retrieval_ms": elapsed_ms(start), "rerank_ms": None, "candidates": len(nodes)}
+
+        top_n = retrieval_options.pop("top_k", None)
+        candidates = self.retrieve(query_str, top_k=self.rerank_candidates, **retrieval_options)
+        retrieved = time.perf_counter()
+        nodes = self.reranker.rerank(query_str, candidates, top_n=top_n)
+        return nodes, {
+            "retrieval_ms": round((retrieved - start) * 1000, 1),
+            "rerank_ms": elapsed_ms(retrieved),
+            "candidates": len(candidates),
+        }
+
+    def query_with_stats(self, query_str: str, **retrieval_options) -> dict:
+        start = time.perf_counter()
+        nodes, stats = self.retrieve_and_rerank(query_str, **retrieval_options)
+
+        generation_start = time.perf_counter()
+        response, context_stats = self.answer_with_stats(query_str, nodes)
+
+        stats.update({
+            **context_stats,
+            "generation_ms": elapsed_ms(generation_start),
+            "total_ms": elapsed_ms(start),
+            "cached": False,
+        })
+        return {"response": response, "stats": stats}
+
+    def custom_query(self, query_str: str, **retrieval_options) -> str:
+        return self.query_with_stats(query_str, **retrieval_options)["response"]
+
+    def stream_query(self, query_str: str, **retrieval_options) -> Iterator[dict]:
+        start = time.perf_counter()
+        nodes, retrieval_stats = self.retrieve_and_rerank(query_str, **retrieval_options)
+        retrieved = time.perf_counter()
+
+        # Sources are sent before generation starts
+        yield {"event": "sources", "data": [source_metadata(n) for n in nodes]}
+
+        formatted_prompt, context_stats = self.format_prompt(query_str, nodes)
+        first_token = None
+        tokens = 0
+        for chunk in self.llm.stream_complete(formatted_prompt):
+            if not chunk.delta:
+                continue
+            first_token = first_token or time.perf_counter()
+            tokens += 1
+            yield {"event": "token", "data": chunk.delta}
 
+        end = time.perf_counter()
+        yield {
+            "event": "done",
+            "data": {
+                **retrieval_stats,
+                **context_stats,
+                "time_to_first_token_ms": round(((first_token or end) - start) * 1000, 1),
+                "generation_ms": round((end - retrieved) * 1000, 1),
+                "total_ms": round((end - start) * 1000, 1),
+                "tokens": tokens,
+            },
+        }
@@ -0,0 +1,108 @@
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+
+class CrossEncoderReranker(BaseNodePostprocessor):
+
+    """Reranks retrieved nodes with a small cross-encoder run on CPU with ONNX Runtime
+       (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 exported to ONNX), then keeps the `top_n`
+       best nodes. Query/passage pairs are scored in batches.
+
+    Args:
+        model_path (str): Directory with the exported model.onnx and its tokenizer.json
+        top_n (int): Nodes kept after reranking
+        batch_size (int): Query/passage pairs scored per ONNX run
+        max_length (int): Tokens of a query/passage pair, longer pairs are truncated
+        threads (Optional[int]): ONNX Runtime intra-op threads
+
+    """
+
+    model_path: str
+    top_n: int = Field(default=5, gt=0)
+    batch_size: int = Field(default=16, gt=0)
+    max_length: int = Field(default=512, gt=0)
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+
+    def __init__(self, model_path: str, threads: Optional[int] = None, **kwargs):
+        # Optional dependencies, only needed when reranking is enabled
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        super().__init__(model_path=model_path, **kwargs)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [model_input.name for model_input in self._session.get_inputs()]
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+        if self._tokenizer.padding is None:
+            self._tokenizer.enable_padding()
+
+    @classmethod
+    def from_env(cls, top_n: int) -> Optional["CrossEncoderReranker"]:
+        """
+        Returns the reranker configured by RERANK_MODEL_PATH, RERANK_BATCH_SIZE, RERANK_MAX_LENGTH
+        and RERANK_THREADS, or None when RERANK_MODEL_PATH is not set
+        """
+        model_path = os.getenv("RERANK_MODEL_PATH")
+        if not model_path:
+            return None
+
+        return cls(
+            model_path=model_path,
+            top_n=top_n,
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE") or 16),
+            max_length=int(os.getenv("RERANK_MAX_LENGTH") or 512),
+            threads=int(os.getenv("RERANK_THREADS") or 0) or None,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderReranker"
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """
+        Returns the relevance score of every text to the query
+        """
+        scores = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self._tokenizer.encode_batch([(query, text) for text in texts[start:start + self.batch_size]])
+            features = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            logits = self._session.run(None, {name: features[name] for name in self._input_names})[0]
+            # Single-logit models score directly, two-class models score with the "relevant" logit
+            scores.append(logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1] - logits[:, 0])
+        return np.concatenate(scores) if scores else np.array([], dtype=np.float32)
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            return nodes
+        return self.rerank(query_bundle.query_str, nodes)
+
+    def rerank(self, query: str, nodes: List[NodeWithScore], top_n: Optional[int] = None) -> List[NodeWithScore]:
+        """
+        Rescores the nodes against the query and keeps the `top_n` best
+        """
+        if not nodes:
+            return nodes
+
+        scores = self.score(query, [node.node.get_content() for node in nodes])
+        return [
+            NodeWithScore(node=nodes[i].node, score=float(scores[i]))
+            for i in np.argsort(-scores, kind="stable")[:top_n or self.top_n]
+        ]
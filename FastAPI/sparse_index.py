@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from llama_index.core.schema import BaseNode
+
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], k: int = 60) -> Dict[str, float]:
+    """
+    Fuses ranked lists of ids with weighted reciprocal-rank fusion: score(id) = sum(weight / (k + rank))
+
+    Returns:
+        Dict[str, float]: Fused score of every id, highest first
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        if not weight:
+            continue
+        for rank, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + weight / (k + rank)
+    return dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
+
+
+class SparseIndex():
+
+    """Local BM25 index of the indexed chunks, one SQLite FTS5 table per Milvus collection.
+       Complements dense retrieval on exact terms (metric names, GRI/ESRS codes...) and answers
+       in milliseconds without a network hop.
+
+    Args:
+        db_path (Optional[str], optional): Path to the SQLite database. Defaults to SPARSE_INDEX_PATH or "./sparse_index.db".
+
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("SPARSE_INDEX_PATH") or "./sparse_index.db"
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Maps node ids to the rowids of the FTS tables
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    collection_name TEXT NOT NULL,
+                    node_id TEXT NOT NULL,
+                    UNIQUE (collection_name, node_id)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _table(collection_name: str) -> str:
+        # Collection names are not valid SQL identifiers in general
+        return "fts_" + hashlib.sha1(collection_name.encode("utf-8")).hexdigest()[:16]
+
+    def _ensure_table(self, conn: sqlite3.Connection, collection_name: str) -> str:
+        table = self._table(collection_name)
+        conn.execute(
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+                text, metadata UNINDEXED, tokenize = 'porter unicode61'
+            )"""
+        )
+        return table
+
+    def add(self, collection_name: str, nodes: List[BaseNode]):
+        """
+        Adds chunks to the index of a collection
+        """
+        with self._connect() as conn:
+            table = self._ensure_table(conn, collection_name)
+            for node in nodes:
+                row_id = conn.execute(
+                    "INSERT INTO chunks (collection_name, node_id) VALUES (?, ?)", (collection_name, node.node_id)
+                ).lastrowid
+                conn.execute(
+                    f"INSERT INTO {table} (rowid, text, metadata) VALUES (?, ?, ?)",
+                    (row_id, node.get_content(), json.dumps(node.metadata)),
+                )
+
+    def delete(self, collection_name: str, node_ids: List[str]):
+        """
+        Removes chunks from the index of a collection
+        """
+        with self._connect() as conn:
+            table = self._ensure_table(conn, collection_name)
+            for start in range(0, len(node_ids), 500):
+                batch = node_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                row_ids = [
+                    row[0] for row in conn.execute(
+                        f"SELECT row_id FROM chunks WHERE collection_name = ? AND node_id IN ({placeholders})",
+                        (collection_name, *batch),
+                    )
+                ]
+                conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(row_id,) for row_id in row_ids])
+                conn.executemany("DELETE FROM chunks WHERE row_id = ?", [(row_id,) for row_id in row_ids])
+
+    def delete_collection(self, collection_name: str):
+        """
+        Drops the index of a collection
+        """
+        with self._connect() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {self._table(collection_name)}")
+            conn.execute("DELETE FROM chunks WHERE collection_name = ?", (collection_name,))
+
+    def search(self, collection_name: str, query: str, top_k: int, file_names: Optional[List[str]] = None,
+               page_nums: Optional[List[int]] = None) -> List[dict]:
+        """
+        Returns the best BM25 matches of a query as dicts with node_id, score, text and metadata, best first,
+        optionally restricted to some files and pages
+        """
+        tokens = list(dict.fromkeys(token.lower() for token in TOKEN_PATTERN.findall(query)))
+        if not tokens:
+            return []
+
+        # Quoting every token keeps FTS5 operators and punctuation in the query from being interpreted
+        match = " OR ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+        conditions, params = [], [match]
+        for key, values in (("file_name", file_names), ("page_num", page_nums)):
+            if values:
+                conditions.append(f"AND json_extract(metadata, '$.{key}') IN ({','.join('?' * len(values))})")
+                params.extend(values)
+
+        with self._connect() as conn:
+            table = self._ensure_table(conn, collection_name)
+            rows = conn.execute(
+                f"""SELECT chunks.node_id, bm25({table}) AS rank, {table}.text, {table}.metadata
+                    FROM {table} JOIN chunks ON chunks.row_id = {table}.rowid
+                    WHERE {table} MATCH ? {' '.join(conditions)} ORDER BY rank LIMIT ?""",
+                (*params, top_k),
+            ).fetchall()
+
+        # FTS5 ranks with negated BM25 scores
+        return [
+            {"node_id": node_id, "score": -rank, "text": text, "metadata": json.loads(metadata)}
+            for node_id, rank, text, metadata in rows
+        ]
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+
+_DONE = object()
+
+
+class Stage():
+
+    """A stage of a StagedPipeline: `workers` threads take items from a queue of `queue_size`
+       and pass each to `fn`, which returns (or yields) the items of the next stage.
+
+    Args:
+        name (str): Name of the stage in the stats
+        fn (Callable[[object], Optional[Iterable]]): Processes an item, returns the items for the next stage or None
+        workers (int): Threads running the stage. Defaults to 1.
+        queue_size (int): Items waiting for the stage before upstream stages block. Defaults to 4.
+
+    """
+
+    def __init__(self, name: str, fn: Callable[[object], Optional[Iterable]], workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+
+class StagedPipeline():
+
+    """Producer/consumer pipeline of stages connected by bounded queues, so every stage works
+       on its own items at the same time and a slow stage holds back its producers instead of
+       letting queued items pile up in memory. The first error stops the pipeline and is raised by `run`.
+
+    Args:
+        stages (List[Stage]): Stages in order, the items of the last stage are discarded
+
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+
+    def run(self, items: Iterable) -> dict:
+        """
+        Feeds the items to the first stage and waits until every stage has finished
+
+        Returns:
+            dict: Wall time and, per stage, items in and out, busy time, throughput, utilisation and queue depth
+
+        Raises:
+            Exception: The first error raised by a stage
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        stats = {
+            stage.name: {"workers": stage.workers, "items_in": 0, "items_out": 0, "busy_seconds": 0.0,
+                         "queue_depth_sum": 0, "max_queue_depth": 0}
+            for stage in self.stages
+        }
+        remaining = [stage.workers for stage in self.stages]
+        # Items waiting in each queue, unlike qsize() this does not count the stop sentinels
+        waiting = [0] * len(self.stages)
+        lock = threading.Lock()
+        failed = threading.Event()
+        errors = []
+
+        def put(index: int, item) -> bool:
+            # Counted before it is queued, so a consumer never takes an item that is not counted yet
+            with lock:
+                waiting[index] += 1
+            # Stops blocking on a full queue once the pipeline has failed, its consumers are draining
+            while not failed.is_set():
+                try:
+                    queues[index].put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            with lock:
+                waiting[index] -= 1
+            return False
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(0, item):
+                        break
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                failed.set()
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        def work(index: int):
+            stage = self.stages[index]
+            stage_stats = stats[stage.name]
+            is_last = index == len(self.stages) - 1
+            while True:
+                with lock:
+                    depth = waiting[index]
+                item = queues[index].get()
+                if item is _DONE:
+                    break
+                with lock:
+                    waiting[index] -= 1
+                if failed.is_set():
+                    continue
+
+                start = time.perf_counter()
+                blocked = 0.0
+                produced = 0
+                try:
+                    for output in stage.fn(item) or ():
+                        produced += 1
+                        if is_last:
+                            continue
+                        put_start = time.perf_counter()
+                        if not put(index + 1, output):
+                            break
+                        blocked += time.perf_counter() - put_start
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    failed.set()
+
+                with lock:
+                    stage_stats["items_in"] += 1
+                    stage_stats["items_out"] += produced
+                    # Time spent waiting on a full downstream queue is not work of this stage
+                    stage_stats["busy_seconds"] += time.perf_counter() - start - blocked
+                    stage_stats["queue_depth_sum"] += depth
+                    stage_stats["max_queue_depth"] = max(stage_stats["max_queue_depth"], depth)
+
+            with lock:
+                remaining[index] -= 1
+                last_worker = remaining[index] == 0
+            # The last worker of a stage tells every worker of the next stage to stop
+            if last_worker and not is_last:
+                for _ in range(self.stages[index + 1].workers):
+                    queues[index + 1].put(_DONE)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(target=work, args=(index,), name=f"pipeline-{stage.name}-{i}", daemon=True)
+                for i in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        if errors:
+            raise errors[0]
+
+        for stage_stats in stats.values():
+            depth_sum = stage_stats.pop("queue_depth_sum")
+            busy = stage_stats["busy_seconds"]
+            stage_stats["busy_seconds"] = round(busy, 3)
+            stage_stats["items_per_second"] = round(stage_stats["items_in"] / wall_seconds, 2) if wall_seconds else 0.0
+            stage_stats["utilization"] = round(busy / (wall_seconds * stage_stats["workers"]), 3) if wall_seconds else 0.0
+            stage_stats["avg_queue_depth"] = round(depth_sum / stage_stats["items_in"], 2) if stage_stats["items_in"] else 0.0
+        return {"wall_seconds": round(wall_seconds, 3), "stages": stats}
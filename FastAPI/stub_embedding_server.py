@@ -0,0 +1,86 @@
+"""Local stand-in for the NVIDIA/OpenAI embeddings API, for exercising the indexing path
+without a remote model. Point the indexer at it with MODEL_HOST=NVIDIA and
+EMBEDDING_BASE_URL=http://localhost:8009/v1.
+
+    python stub_embedding_server.py --port 8009 --dim 1024 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_embedding(text: str, dim: int) -> list:
+    """
+    Deterministic unit vector for a text, so identical texts always get identical embeddings
+    """
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+
+    config = None
+
+    def _send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.config.model, "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+
+        # Simulate a throttled or failing upstream
+        if random.random() < self.config.error_rate:
+            self._send_json(random.choice([429, 503]), {"error": "simulated failure"})
+            return
+
+        time.sleep(self.config.latency + self.config.latency_per_text * len(texts))
+        self._send_json(200, {
+            "object": "list",
+            "model": body.get("model", self.config.model),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": stub_embedding(text, self.config.dim)}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts), "total_tokens": sum(len(t) // 4 for t in texts)},
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub embedding server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8009)
+    parser.add_argument("--model", default="NV-Embed-QA")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--latency", type=float, default=0.1, help="Fixed latency per request in seconds")
+    parser.add_argument("--latency-per-text", type=float, default=0.002, help="Additional latency per text in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429/503")
+    args = parser.parse_args()
+
+    StubEmbeddingHandler.config = args
+    server = ThreadingHTTPServer((args.host, args.port), StubEmbeddingHandler)
+    print(f"Stub embedding server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
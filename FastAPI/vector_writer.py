@@ -0,0 +1,147 @@
+import os
+import random
+import threading
+import time
+from typing import List, Optional
+
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+
+class VectorWriter():
+
+    """Inserts nodes into the vector store in batches of `batch_size` rows. Nodes are buffered
+       across calls to `add` until a batch is full, failed batches are retried with exponential
+       backoff, and flushing (and compaction) of the collection is left to `finish`, called once
+       at the end of a run or bulk job instead of after every insert.
+
+    Args:
+        store (BasePydanticVectorStore): Milvus or local vector store the nodes are written to
+        batch_size (Optional[int], optional): Rows per insert. Defaults to VECTOR_WRITE_BATCH_SIZE or 1000.
+        max_retries (Optional[int], optional): Retries per failed batch. Defaults to VECTOR_WRITE_MAX_RETRIES or 3.
+        backoff_seconds (float): Base delay of the exponential backoff. Defaults to 0.5.
+
+    """
+
+    def __init__(self, store: BasePydanticVectorStore, batch_size: Optional[int] = None,
+                 max_retries: Optional[int] = None, backoff_seconds: float = 0.5):
+        self.store = store
+        self.batch_size = batch_size or int(os.getenv("VECTOR_WRITE_BATCH_SIZE") or 1000)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("VECTOR_WRITE_MAX_RETRIES") or 3)
+        self.backoff_seconds = backoff_seconds
+        self._buffer: List[BaseNode] = []
+        self._lock = threading.Lock()
+        self._stats = {"rows": 0, "batches": 0, "retries": 0, "write_seconds": 0.0,
+                       "flushes": 0, "flush_seconds": 0.0, "compactions": 0}
+
+    def add(self, nodes: List[BaseNode]):
+        """
+        Buffers the nodes and inserts every full batch
+        """
+        with self._lock:
+            self._buffer.extend(nodes)
+            batches = []
+            while len(self._buffer) >= self.batch_size:
+                batches.append(self._buffer[:self.batch_size])
+                del self._buffer[:self.batch_size]
+
+        for batch in batches:
+            self.write_batch(batch)
+
+    def write_pending(self):
+        """
+        Inserts the buffered nodes, e.g. before recording a file as indexed
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        for start in range(0, len(batch), self.batch_size):
+            self.write_batch(batch[start:start + self.batch_size])
+
+    def discard(self, node_ids: List[str]) -> int:
+        """
+        Drops the buffered nodes with the given ids, e.g. the nodes of a file whose indexing failed
+
+        Returns:
+            int: Number of nodes dropped from the buffer
+        """
+        node_ids = set(node_ids)
+        with self._lock:
+            kept = [node for node in self._buffer if node.node_id not in node_ids]
+            dropped = len(self._buffer) - len(kept)
+            self._buffer = kept
+        return dropped
+
+    def clear(self) -> int:
+        """
+        Drops every buffered node
+
+        Returns:
+            int: Number of nodes dropped from the buffer
+        """
+        with self._lock:
+            dropped, self._buffer = len(self._buffer), []
+        return dropped
+
+    def write_batch(self, nodes: List[BaseNode]):
+        """
+        Inserts one batch, retrying on failure. A batch whose insert may have partly succeeded
+        is deleted before it is inserted again, so retries never duplicate rows.
+        """
+        if not nodes:
+            return
+
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                if attempt:
+                    self.store.delete_nodes(node_ids=[node.node_id for node in nodes])
+                self.store.add(nodes)
+                break
+            except ValueError:
+                # Bad data (e.g. wrong vector dimension) fails the same way on every attempt
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+                print(f"Inserting {len(nodes)} vectors failed ({e}), retrying")
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, self.backoff_seconds * 2 ** attempt))
+
+        with self._lock:
+            self._stats["rows"] += len(nodes)
+            self._stats["batches"] += 1
+            self._stats["write_seconds"] += time.perf_counter() - start
+
+    def finish(self, compact: bool = False):
+        """
+        Inserts the buffered nodes and flushes the collection, so its segments are sealed and indexed.
+        With `compact`, also merges small segments and purges deleted rows.
+        """
+        self.write_pending()
+        # The local store writes through on every insert and has no client to flush
+        client = getattr(self.store, "client", None)
+        if client is None:
+            return
+
+        start = time.perf_counter()
+        client.flush(self.store.collection_name)
+        if compact:
+            client.compact(self.store.collection_name)
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["flush_seconds"] += time.perf_counter() - start
+            self._stats["compactions"] += int(compact)
+
+    def stats(self) -> dict:
+        """
+        Returns rows and batches written, retries, insert throughput (rows/s) and flush counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+        stats["rows_per_second"] = round(stats["rows"] / stats["write_seconds"], 1) if stats["write_seconds"] else 0.0
+        stats["write_seconds"] = round(stats["write_seconds"], 3)
+        stats["flush_seconds"] = round(stats["flush_seconds"], 3)
+        return stats
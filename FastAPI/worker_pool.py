@@ -0,0 +1,176 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Iterator
+
+
+class PoolFullError(Exception):
+    """Raised when a task is submitted to a worker pool whose queue is full."""
+
+
+class WorkerPool():
+
+    """Bounded pool of workers for running blocking work off the event loop.
+       At most `max_workers` tasks run at once and at most `max_queue` more wait for a worker,
+       anything beyond that is rejected with PoolFullError instead of piling up.
+
+    Args:
+        name (str): Name of the pool, used in metrics and thread names
+        max_workers (int): Number of threads/processes running tasks
+        max_queue (int): Number of tasks allowed to wait for a free worker
+        kind (str): "thread" or "process". Process pools require picklable module-level callables.
+
+    """
+
+    def __init__(self, name: str, max_workers: int = 4, max_queue: int = 32, kind: str = "thread"):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.executor = self.initialize_executor()
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_queue_depth = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, name: str, default_workers: int, default_queue: int, default_kind: str = "thread"):
+        """
+        Builds a pool from <NAME>_POOL_WORKERS, <NAME>_POOL_QUEUE_SIZE and <NAME>_POOL_KIND
+        """
+        prefix = f"{name.upper()}_POOL"
+        return cls(
+            name=name,
+            max_workers=int(os.getenv(f"{prefix}_WORKERS") or default_workers),
+            max_queue=int(os.getenv(f"{prefix}_QUEUE_SIZE") or default_queue),
+            kind=os.getenv(f"{prefix}_KIND") or default_kind,
+        )
+
+    def initialize_executor(self) -> Executor:
+        if self.kind == "thread":
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-pool")
+        elif self.kind == "process":
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            raise ValueError(f"Unsupported worker pool kind: {self.kind}")
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Submits a task to the pool
+
+        Raises:
+            PoolFullError: If all workers are busy and the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolFullError(f"The {self.name} pool is full ({self.max_workers} running, {self.max_queue} queued)")
+
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue_depth())
+
+        start = time.perf_counter()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(start, failed=True)
+            raise
+
+        future.add_done_callback(lambda f: self._release(start, failed=f.cancelled() or f.exception() is not None))
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a task on the pool and awaits its result without blocking the event loop
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stream(self, items: Iterator) -> AsyncIterator:
+        """
+        Iterates a blocking iterator (e.g. a streamed LLM response) on the pool and returns an async
+        iterator of its items. The iterator holds one slot of the pool until it is exhausted or the
+        consumer stops, so streams count against the pool like any other task. Thread pools only.
+
+        Raises:
+            PoolFullError: If all workers are busy and the queue is full, before anything is iterated
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in items:
+                    # The consumer went away, e.g. the client disconnected
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+                raise
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+        self.submit(produce)
+
+        async def consume():
+            try:
+                while True:
+                    item, error = await queue.get()
+                    if item is done:
+                        if error is not None:
+                            raise error
+                        return
+                    yield item
+            finally:
+                stopped.set()
+
+        return consume()
+
+    def _release(self, start: float, failed: bool):
+        with self._lock:
+            self._in_flight -= 1
+            self._total_seconds += time.perf_counter() - start
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+        self._slots.release()
+
+    def _queue_depth(self) -> int:
+        return max(0, self._in_flight - self.max_workers)
+
+    def metrics(self) -> dict:
+        """
+        Returns the queue depth and task counters of the pool
+        """
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": min(self._in_flight, self.max_workers),
+                "queue_depth": self._queue_depth(),
+                "max_queue_depth": self._max_queue_depth,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_task_seconds": self._total_seconds / finished if finished else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,136 @@
+"""Compares Milvus index types and search parameters: recall@k against brute force, and query latency.
+
+Runs against Milvus Lite (a local file, the default) or a Milvus server. Each setting is
+INDEX_TYPE[:build_params[:search_params]], parameters as comma-separated key=value pairs:
+
+    python benchmarks/milvus_index.py --vectors 50000 --dim 512 \\
+        --settings FLAT IVF_FLAT:nlist=1024:nprobe=16 IVF_PQ:nlist=1024,m=16:nprobe=32 HNSW:M=16,efConstruction=200:ef=64
+    python benchmarks/milvus_index.py --uri http://localhost:19530
+
+Milvus Lite does not build IVF_PQ indexes and searches them by brute force; benchmark IVF_PQ on a server.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FastAPI"))
+
+import milvus_settings  # noqa: E402
+
+
+DEFAULT_SETTINGS = ["FLAT", "IVF_FLAT:nlist=256:nprobe=8", "IVF_FLAT:nlist=256:nprobe=32",
+                    "IVF_PQ:nlist=256,m=16:nprobe=32", "HNSW:M=16,efConstruction=200:ef=64"]
+
+
+def parse_params(text: str) -> dict:
+    params = {}
+    for pair in filter(None, text.split(",")):
+        key, value = pair.split("=", 1)
+        params[key.strip()] = int(value) if value.strip().isdigit() else float(value)
+    return params
+
+
+def parse_setting(setting: str):
+    parts = setting.split(":")
+    index = milvus_settings.index_type(parts[0])
+    build = parse_params(parts[1]) if len(parts) > 1 else {}
+    search = parse_params(parts[2]) if len(parts) > 2 else {}
+    return index, milvus_settings.index_config(index, build), milvus_settings.search_config(index, search)
+
+
+def make_vectors(count: int, centers: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Unit vectors clustered around the centers, closer to text embeddings than uniform noise.
+    Queries are drawn around the same centers as the data, like questions about indexed documents.
+    """
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.normal(size=(count, centers.shape[1]))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def brute_force(vectors: np.ndarray, queries: np.ndarray, k: int, metric: str) -> np.ndarray:
+    if metric == "L2":
+        distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(1)[None, :]
+        return np.argsort(distances, axis=1)[:, :k]
+    # IP and COSINE are the same on unit vectors
+    return np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+
+def run_setting(client: MilvusClient, setting: str, vectors: np.ndarray, queries: np.ndarray,
+                truth: np.ndarray, k: int, metric: str, batch_size: int) -> dict:
+    index, index_config, search_config = parse_setting(setting)
+    collection_name = "bench_" + "".join(c if c.isalnum() else "_" for c in setting.lower())
+    if client.has_collection(collection_name):
+        client.drop_collection(collection_name)
+
+    schema = client.create_schema(auto_id=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("embedding", DataType.FLOAT_VECTOR, dim=vectors.shape[1])
+    index_params = client.prepare_index_params()
+    build_params = {key: value for key, value in index_config.items() if key != "index_type"}
+    index_params.add_index(field_name="embedding", index_type=index, metric_type=metric, params=build_params)
+
+    start = time.perf_counter()
+    client.create_collection(collection_name, schema=schema, index_params=index_params)
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset:offset + batch_size]
+        client.insert(collection_name, [{"id": offset + i, "embedding": vector.tolist()} for i, vector in enumerate(batch)])
+    client.flush(collection_name)
+    client.load_collection(collection_name)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = client.search(collection_name, data=[query.tolist()], limit=k, anns_field="embedding",
+                                search_params={"metric_type": metric, **search_config})
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({hit["id"] for hit in results[0]} & set(expected.tolist()))
+
+    client.drop_collection(collection_name)
+    latencies.sort()
+    return {
+        "setting": setting,
+        "recall": hits / (len(queries) * k),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "build_s": build_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of Milvus index settings")
+    parser.add_argument("--uri", default="./milvus_index_benchmark.db", help="Milvus Lite file or server URI")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metric", default="IP", choices=["IP", "COSINE", "L2"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--settings", nargs="+", default=DEFAULT_SETTINGS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.clusters, args.dim))
+    vectors = make_vectors(args.vectors, centers, rng)
+    queries = make_vectors(args.queries, centers, rng)
+    truth = brute_force(vectors, queries, args.k, args.metric)
+
+    client = MilvusClient(args.uri)
+    print(f"{args.vectors} vectors, dim {args.dim}, {args.queries} queries, k={args.k}, metric {args.metric}, {args.uri}")
+    print(f"{'setting':45s} {'recall@k':>9s} {'p50 ms':>8s} {'p99 ms':>8s} {'build s':>8s}")
+    for setting in args.settings:
+        result = run_setting(client, setting, vectors, queries, truth, args.k, args.metric, args.batch_size)
+        print(f"{result['setting']:45s} {result['recall']:9.3f} {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} {result['build_s']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
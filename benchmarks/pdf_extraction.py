@@ -0,0 +1,58 @@
+"""Compares serial and parallel per-page PDF text extraction.
+
+    python benchmarks/pdf_extraction.py --backend pymupdf --workers 2 4 8 --repeat 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers.parallel import extract_pages, get_extraction_pool, PDF_BACKENDS  # noqa: E402
+
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "data", "Sustainability_Report_Evaluation.pdf")
+
+
+def time_extraction(file_path: str, backend: str, workers: int, repeat: int, pages_per_task: int):
+    timings = []
+    texts = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        texts = [text for _, text in extract_pages(file_path, backend, workers, pages_per_task)]
+        timings.append(time.perf_counter() - start)
+    return timings, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs parallel PDF text extraction")
+    parser.add_argument("--file", default=DEFAULT_FILE)
+    parser.add_argument("--backend", choices=PDF_BACKENDS, nargs="+", default=list(PDF_BACKENDS))
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument("--pages-per-task", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"File: {args.file} ({os.cpu_count()} CPUs)")
+    for backend in args.backend:
+        serial_timings, serial_texts = time_extraction(args.file, backend, 1, args.repeat, args.pages_per_task)
+        serial = statistics.median(serial_timings)
+        print(f"\n[{backend}] {len(serial_texts)} pages")
+        print(f"  serial            {serial:8.3f}s")
+
+        for workers in sorted(set(args.workers)):
+            if workers <= 1:
+                continue
+            # Start the pool outside the timed runs
+            list(get_extraction_pool(workers).map(abs, range(workers)))
+            timings, texts = time_extraction(args.file, backend, workers, args.repeat, args.pages_per_task)
+            parallel = statistics.median(timings)
+            same = "identical" if texts == serial_texts else "MISMATCH"
+            print(f"  {workers:2d} workers        {parallel:8.3f}s  speedup {serial / parallel:5.2f}x  ({same} output)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Measures the insert throughput (rows/s) of the batched vector writer for several batch sizes.
+
+Runs without a server against a fake store that simulates the cost of a Milvus insert request
+(fixed latency per request plus a cost per row), of a flush, and failing requests. The baselines
+insert every upsert of the pipeline as it comes, with and without a flush after it. Milvus Lite (--uri) and the
+local store (--store local) can be benchmarked as well:
+
+    python benchmarks/vector_insert.py --rows 50000 --batch-sizes 100 500 1000 2000
+    python benchmarks/vector_insert.py --store fake --failure-rate 0.05
+    python benchmarks/vector_insert.py --store milvus --uri ./vector_insert_benchmark.db
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FastAPI"))
+
+from vector_writer import VectorWriter  # noqa: E402
+
+
+class FakeClient():
+
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+
+    def flush(self, collection_name: str):
+        time.sleep(self.flush_seconds)
+
+    def compact(self, collection_name: str):
+        pass
+
+
+class FakeVectorStore():
+
+    """Stands in for MilvusVectorStore: every add costs `request_seconds` plus `row_seconds` per row,
+       and fails with probability `failure_rate` after doing the work"""
+
+    def __init__(self, request_seconds: float, row_seconds: float, flush_seconds: float, failure_rate: float):
+        self.collection_name = "benchmark"
+        self.client = FakeClient(flush_seconds)
+        self.request_seconds = request_seconds
+        self.row_seconds = row_seconds
+        self.failure_rate = failure_rate
+        self.rows = {}
+
+    def add(self, nodes, **add_kwargs):
+        time.sleep(self.request_seconds + self.row_seconds * len(nodes))
+        for node in nodes:
+            self.rows[node.node_id] = node.embedding
+        if random.random() < self.failure_rate:
+            raise ConnectionError("simulated insert failure")
+        return [node.node_id for node in nodes]
+
+    def delete_nodes(self, node_ids=None, **delete_kwargs):
+        time.sleep(self.request_seconds)
+        for node_id in node_ids or []:
+            self.rows.pop(node_id, None)
+
+
+def make_nodes(count: int, dim: int, rng: np.random.Generator) -> list:
+    vectors = rng.normal(size=(count, dim)).astype(np.float32)
+    return [
+        TextNode(text=f"chunk {i}", metadata={"file_name": f"file{i // 500}.pdf", "page_num": i % 500},
+                 embedding=vector.tolist())
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def make_store(args, batch_size: int, workdir: str):
+    if args.store == "fake":
+        return FakeVectorStore(args.request_ms / 1000, args.row_us / 1e6, args.flush_ms / 1000, args.failure_rate)
+
+    if args.store == "local":
+        from local_vector_store import LocalVectorStore
+        return LocalVectorStore(collection_name=f"benchmark_{batch_size}", dim=args.dim, path=os.path.join(workdir, str(batch_size)))
+
+    from llama_index.vector_stores.milvus import MilvusVectorStore
+    return MilvusVectorStore(uri=args.uri, collection_name=f"benchmark_{batch_size}", dim=args.dim,
+                             overwrite=True, batch_size=batch_size)
+
+
+def run_baseline(store, nodes: list, upsert_size: int, flush: bool) -> float:
+    """
+    Inserts each upsert of the pipeline as it comes, flushing after it with `flush`
+    """
+    start = time.perf_counter()
+    for offset in range(0, len(nodes), upsert_size):
+        batch = nodes[offset:offset + upsert_size]
+        for attempt in range(4):
+            try:
+                store.add(batch)
+                break
+            except ConnectionError:
+                store.delete_nodes(node_ids=[node.node_id for node in batch])
+        if flush and store.client is not None:
+            store.client.flush(store.collection_name)
+    return time.perf_counter() - start
+
+
+def run_writer(store, nodes: list, upsert_size: int, batch_size: int) -> tuple:
+    writer = VectorWriter(store, batch_size=batch_size, backoff_seconds=0.01)
+    start = time.perf_counter()
+    for offset in range(0, len(nodes), upsert_size):
+        writer.add(nodes[offset:offset + upsert_size])
+    writer.finish()
+    return time.perf_counter() - start, writer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert throughput of the batched vector writer")
+    parser.add_argument("--store", default="fake", choices=["fake", "local", "milvus"])
+    parser.add_argument("--uri", default="./vector_insert_benchmark.db", help="Milvus Lite file or server URI")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--upsert-size", type=int, default=40, help="Rows handed to the writer per pipeline upsert")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    parser.add_argument("--request-ms", type=float, default=20.0, help="Fake store latency per insert request")
+    parser.add_argument("--row-us", type=float, default=20.0, help="Fake store cost per row")
+    parser.add_argument("--flush-ms", type=float, default=200.0, help="Fake store latency per flush")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fake store share of failing inserts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    nodes = make_nodes(args.rows, args.dim, np.random.default_rng(args.seed))
+    workdir = tempfile.mkdtemp(prefix="vector_insert_benchmark_")
+    try:
+        print(f"{args.rows} rows, dim {args.dim}, {args.upsert_size} rows per upsert, {args.store} store")
+        print(f"{'mode':28s} {'seconds':>8s} {'rows/s':>10s} {'batches':>8s} {'retries':>8s}")
+
+        for flush in (False, True):
+            seconds = run_baseline(make_store(args, args.upsert_size, workdir), nodes, args.upsert_size, flush)
+            mode = "insert + flush per upsert" if flush else "insert per upsert"
+            print(f"{mode:28s} {seconds:8.2f} {args.rows / seconds:10.0f} {'':>8s} {'':>8s}")
+
+        for batch_size in args.batch_sizes:
+            seconds, stats = run_writer(make_store(args, batch_size, workdir), nodes, args.upsert_size, batch_size)
+            print(f"{f'writer, batch {batch_size}':28s} {seconds:8.2f} {args.rows / seconds:10.0f} "
+                  f"{stats['batches']:8d} {stats['retries']:8d}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
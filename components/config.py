@@ -14,6 +14,9 @@ class CouchDb:
     username = os.getenv("COUCH_DB_USERNAME")
     password = os.getenv("COUCH_DB_PASSWORD")
     endpoint = os.getenv("COUCH_DB_ENDPOINT").replace("http://", "").replace("https://", "")
+    bulk_batch_size = int(os.getenv("COUCH_DB_BULK_BATCH_SIZE") or 500)  # Documents per _bulk_docs request
+    pool_size = int(os.getenv("COUCH_DB_POOL_SIZE") or 10)  # Pooled HTTP connections
+    max_retries = int(os.getenv("COUCH_DB_MAX_RETRIES") or 3)  # Retries of a failed document
 
 # Minio Configurations
 class MinioDb:
@@ -25,6 +28,10 @@ class MinioDb:
 UPLOAD_FOLDER = "./uploads"
 LOGS_FOLDER = "./logs"
 
+# Crash recovery of files left in UPLOAD_FOLDER
+SWEEP_INTERVAL_SECONDS = int(os.getenv("SWEEP_INTERVAL_SECONDS") or 300)
+SWEEP_MIN_AGE_SECONDS = int(os.getenv("SWEEP_MIN_AGE_SECONDS") or 900)  # Before a new workspace is checked for its lock
+
 def setup_logging():
     """
     Set up logging for the application.
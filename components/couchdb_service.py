@@ -0,0 +1,243 @@
+import hashlib
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import CouchDb
+
+
+class DocumentNotFoundError(RuntimeError):
+    """
+    Raised when no documents match the source of a deletion.
+    """
+
+
+def document_id(doc):
+    """
+    Return a deterministic id for a page, from its source and page number.
+
+    Inserting the same page twice then conflicts instead of creating a second
+    copy, so a batch can be retried safely after an ambiguous failure.
+
+    Args:
+        doc (dict): The document, with 'source' and 'page' in its metadata.
+
+    Returns:
+        str or None: The id, or None if the document has no source.
+    """
+    metadata = doc.get("metadata") or {}
+    if metadata.get("source") is None:
+        return None
+    key = f"{metadata['source']}\x00{metadata.get('page')}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class CouchDBClient:
+    """
+    A client interface for interacting with CouchDB
+
+    This class provides methods to insert documents into a CouchDB database,
+    one at a time or in bulk through the `_bulk_docs` endpoint, and to delete
+    documents by their source. All requests share one pooled HTTP session.
+    """
+
+    def __init__(self, base_url=None, session=None):
+        self.base_url = (base_url or f"http://{CouchDb.endpoint}").rstrip("/")
+        self.session = session or self._initialize_session()
+        self._databases = set()
+
+    def _initialize_session(self):
+        """
+        Initialize and return a pooled HTTP session for CouchDB.
+
+        The session authenticates with the credentials from the CouchDb
+        configuration and keeps up to `CouchDb.pool_size` connections alive,
+        so consecutive requests reuse the same connections.
+
+        Returns:
+            requests.Session: The session used for every CouchDB request.
+        """
+        session = requests.Session()
+        session.auth = (CouchDb.username, CouchDb.password)
+        session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=CouchDb.pool_size,
+            max_retries=Retry(connect=CouchDb.max_retries, backoff_factor=0.2),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _url(self, *parts):
+        return "/".join([self.base_url, *parts])
+
+    def ensure_database(self, dbname):
+        """
+        Create the database if it does not exist.
+
+        Args:
+            dbname (str): The name of the CouchDB database.
+        """
+        if dbname in self._databases:
+            return
+
+        response = self.session.head(self._url(dbname))
+        if response.status_code == 404:
+            print(f"Database '{dbname}' does not exist. Creating a new database")
+            response = self.session.put(self._url(dbname))
+            # 412: created concurrently by another request
+            if response.status_code not in (201, 202, 412):
+                response.raise_for_status()
+        else:
+            response.raise_for_status()
+
+        self._databases.add(dbname)
+
+    def insert_document(self, dbname, doc):
+        """
+        Insert a document into a specified CouchDB database.
+
+        Creates a new database if it does not exist.
+
+        Args:
+            dbname (str): The name of the CouchDB database.
+            doc (dict): The document to insert.
+
+        Returns:
+            dict: The response from CouchDB, with the id and revision of the
+            document.
+        """
+        self.ensure_database(dbname)
+        response = self.session.post(self._url(dbname), json=doc)
+        response.raise_for_status()
+        return response.json()
+
+    def bulk_insert_documents(self, dbname, docs, batch_size=None):
+        """
+        Insert documents into a specified CouchDB database in bulk.
+
+        Documents are sent through `_bulk_docs` in batches of `batch_size`.
+        Documents rejected by CouchDB, and every document of a batch whose
+        request failed, are retried one at a time. Pages get a deterministic
+        `_id` (see `document_id`), so a retry of a page that was in fact
+        committed, e.g. before a read timeout, conflicts and counts as
+        inserted instead of creating a duplicate.
+
+        Args:
+            dbname (str): The name of the CouchDB database.
+            docs (list[dict]): The documents to insert.
+            batch_size (int, optional): Documents per `_bulk_docs` request.
+            Defaults to `CouchDb.bulk_batch_size`.
+
+        Returns:
+            dict: The number of inserted documents and the documents that
+            could not be inserted, each with its error.
+        """
+        self.ensure_database(dbname)
+        batch_size = batch_size or CouchDb.bulk_batch_size
+        inserted = 0
+        failed = []
+
+        for start in range(0, len(docs), batch_size):
+            batch = [
+                doc if "_id" in doc or document_id(doc) is None else {"_id": document_id(doc), **doc}
+                for doc in docs[start:start + batch_size]
+            ]
+            try:
+                response = self.session.post(
+                    self._url(dbname, "_bulk_docs"), json={"docs": batch}
+                )
+                response.raise_for_status()
+                results = response.json()
+            except requests.RequestException as e:
+                results = [{"error": "request_failed", "reason": str(e)}] * len(batch)
+
+            # _bulk_docs answers with one result per document, in order
+            for doc, result in zip(batch, results):
+                if "error" not in result:
+                    inserted += 1
+                    continue
+
+                error = self._retry_insert(dbname, doc)
+                if error is None:
+                    inserted += 1
+                else:
+                    failed.append({"doc": doc, "error": error})
+
+        return {"inserted": inserted, "failed": failed}
+
+    def _retry_insert(self, dbname, doc):
+        """
+        Retry inserting a single document, returning the last error or None
+        on success. A conflict means the document is already stored, which
+        counts as a success.
+        """
+        error = None
+        for attempt in range(CouchDb.max_retries):
+            try:
+                self.insert_document(dbname, doc)
+                return None
+            except requests.RequestException as e:
+                error = str(e)
+                # The document was stored by an earlier attempt
+                if e.response is not None and e.response.status_code == 409:
+                    return None
+                time.sleep(0.2 * 2 ** attempt)
+        return error
+
+    def delete_document_by_source(self, dbname, source_value):
+        """
+        Delete documents from a specified CouchDB database based on the
+        'source' field.
+
+        Matching documents are found with `_find` and deleted in bulk.
+
+        Args:
+            dbname (str): The name of the CouchDB database.
+            source_value (str): The 'source' field value used to locate the
+            document(s) to delete.
+
+        Raises:
+            DocumentNotFoundError: If no documents are found.
+            RuntimeError: If the deletion fails.
+        """
+        try:
+            query = {
+                "selector": {"metadata": {"source": source_value}},
+                "fields": ["_id", "_rev"],
+                "limit": CouchDb.bulk_batch_size,
+            }
+            deleted = 0
+
+            while True:
+                # Query CouchDB to find documents by the source field
+                response = self.session.post(self._url(dbname, "_find"), json=query)
+                response.raise_for_status()
+                docs = response.json().get("docs", [])
+                if not docs:
+                    break
+
+                tombstones = [
+                    {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+                    for doc in docs
+                ]
+                response = self.session.post(
+                    self._url(dbname, "_bulk_docs"), json={"docs": tombstones}
+                )
+                response.raise_for_status()
+                removed = sum(1 for result in response.json() if "error" not in result)
+                deleted += removed
+                # Stop instead of finding the same undeletable documents again
+                if removed == 0:
+                    raise RuntimeError("CouchDB rejected the deletion of the matching documents.")
+
+            if deleted == 0:
+                raise DocumentNotFoundError("No documents matching the source were found.")
+
+        except DocumentNotFoundError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Failed to delete document: {str(e)}")
@@ -1,21 +1,257 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import fcntl
 import os
+import shutil
+import tempfile
+import time
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-# from couchdb_service import CouchDBClient
+from couchdb_service import CouchDBClient, DocumentNotFoundError
 from minio_service import MinIOClient
-# from parse_funcs import *
-from config import CouchDb, UPLOAD_FOLDER, setup_logging
+from parsing_service import parse_document
+from config import (
+    CouchDb,
+    UPLOAD_FOLDER,
+    SWEEP_INTERVAL_SECONDS,
+    SWEEP_MIN_AGE_SECONDS,
+    setup_logging,
+)
 
 load_dotenv()
-app = FastAPI()
 minio_client = MinIOClient()
-# couchdb_client = CouchDBClient()
+couchdb_client = CouchDBClient()
 logger = setup_logging()
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Every webhook event downloads into its own workspace under UPLOAD_FOLDER
+EVENT_WORKSPACE_PREFIX = "event-"
+SWEEPING_SUFFIX = ".sweeping"
+# Locked for as long as a workspace is in use, released by the OS if the process dies
+WORKSPACE_LOCK = ".workspace.lock"
+
+
+@contextmanager
+def hold_workspace(workspace):
+    """
+    Mark a workspace as in use for the duration of the block, by holding an
+    exclusive lock on a file in it.
+
+    Args:
+        workspace (str): The path of the workspace.
+    """
+    with open(os.path.join(workspace, WORKSPACE_LOCK), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def workspace_in_use(path):
+    """
+    Check whether a live event or sweeper holds the lock of a workspace.
+
+    Args:
+        path (str): The path of the workspace.
+
+    Returns:
+        bool: True if the workspace lock is held.
+    """
+    try:
+        lock = open(os.path.join(path, WORKSPACE_LOCK))
+    except OSError:
+        return False  # Not a workspace, or a workspace of an earlier version
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+
+def process_file(file_path, file_name):
+    """
+    Parse a downloaded file once and insert its pages into CouchDB.
+
+    The 'source' of every page is set to the file's canonical path in
+    UPLOAD_FOLDER rather than its workspace path, so that the delete-file
+    webhook can find the pages again.
+
+    Args:
+        file_path (str): The local path of the downloaded file.
+        file_name (str): The name of the file.
+
+    Returns:
+        int: The number of pages inserted into CouchDB.
+
+    Raises:
+        RuntimeError: If some pages could not be inserted into CouchDB.
+    """
+    parsed_document = parse_document(file_path)
+    logger.info(f"Successfully parsed file '{file_name}'")
+
+    source_value = os.path.join(UPLOAD_FOLDER, file_name)
+    for page in parsed_document:
+        page["metadata"]["source"] = source_value
+
+    result = couchdb_client.bulk_insert_documents(CouchDb.db_name, parsed_document)
+    if result["failed"]:
+        raise RuntimeError(
+            f"{len(result['failed'])} of {len(parsed_document)} pages "
+            f"could not be inserted into CouchDB: {result['failed'][0]['error']}"
+        )
+    logger.info(f"Inserted {result['inserted']} pages of '{file_name}' into CouchDB")
+    return result["inserted"]
+
+
+def handle_new_file(bucket_name, key):
+    """
+    Download an object into a workspace of its own, process it and remove
+    the workspace.
+
+    Concurrent events never share files, so each object is parsed and
+    inserted exactly once. The workspace is only left behind if the process
+    dies while handling the event, in which case the sweeper picks it up.
+
+    Args:
+        bucket_name (str): The name of the bucket in MinIO.
+        key (str): The key of the object in the bucket.
+
+    Returns:
+        int: The number of pages inserted into CouchDB.
+    """
+    file_name = key.split("/")[-1]
+    workspace = tempfile.mkdtemp(prefix=EVENT_WORKSPACE_PREFIX, dir=UPLOAD_FOLDER)
+    file_path = os.path.join(workspace, file_name)
+    logger.debug(f"Computed file_name: {file_name}, file_path: {file_path}")
+
+    try:
+        # The sweeper leaves the workspace alone for as long as the event runs
+        with hold_workspace(workspace):
+            # Download the file from MinIO
+            minio_client.download_file(bucket_name, file_name, file_path)
+            return process_file(file_path, file_name)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+        logger.info(f"Removed workspace '{workspace}' of file '{file_name}'")
+
+
+def sweep_leftover_files(min_age_seconds=SWEEP_MIN_AGE_SECONDS):
+    """
+    Recover files left in UPLOAD_FOLDER by events whose process crashed.
+
+    Workspaces older than `min_age_seconds` (including those of a sweeper that
+    crashed, and loose files left by earlier versions of this service) are
+    claimed by atomically renaming them, so
+    that concurrent sweepers never process the same leftovers. Workspaces
+    whose lock is held by a live event or sweeper are skipped however long
+    they have been running. The pages
+    already inserted for a leftover file are deleted before it is processed
+    again, so recovering a file that was partly inserted does not create
+    duplicates. Recovered files are removed, and a workspace whose recovery
+    failed is kept so that the next sweep retries its remaining files.
+
+    Args:
+        min_age_seconds (int): Minimum age of a workspace before it is
+        considered abandoned.
+
+    Returns:
+        int: The number of files recovered.
+    """
+    recovered = 0
+    now = time.time()
+
+    for entry in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, entry)
+        try:
+            # Recent workspaces may not have taken their lock yet
+            if now - os.path.getmtime(path) < min_age_seconds:
+                continue
+        except FileNotFoundError:
+            continue  # Removed by its event since it was listed
+        if not (entry.startswith(EVENT_WORKSPACE_PREFIX) or os.path.isfile(path)):
+            continue
+        if os.path.isdir(path) and workspace_in_use(path):
+            continue
+
+        claimed = tempfile.mkdtemp(prefix=EVENT_WORKSPACE_PREFIX, suffix=SWEEPING_SUFFIX, dir=UPLOAD_FOLDER)
+        with hold_workspace(claimed):
+            recovered += recover_workspace(claimed, path, entry)
+
+    return recovered
+
+
+def recover_workspace(claimed, path, entry):
+    """
+    Move a leftover workspace or file into a claimed workspace and process
+    the files in it.
+
+    Args:
+        claimed (str): The workspace claimed by this sweeper, locked by it.
+        path (str): The path of the leftover workspace or file.
+        entry (str): The name of the leftover in UPLOAD_FOLDER.
+
+    Returns:
+        int: The number of files recovered.
+    """
+    recovered = 0
+    try:
+        # Claim the leftovers, only one sweeper can move them
+        os.rename(path, os.path.join(claimed, entry))
+    except OSError:
+        shutil.rmtree(claimed, ignore_errors=True)
+        return recovered
+
+    try:
+        for root, _, files in os.walk(claimed):
+            for file_name in files:
+                if file_name == WORKSPACE_LOCK:
+                    continue
+                try:
+                    couchdb_client.delete_document_by_source(
+                        CouchDb.db_name, os.path.join(UPLOAD_FOLDER, file_name)
+                    )
+                except DocumentNotFoundError:
+                    pass  # Nothing was inserted before the crash
+                process_file(os.path.join(root, file_name), file_name)
+                os.remove(os.path.join(root, file_name))
+                recovered += 1
+                logger.info(f"Recovered leftover file '{file_name}'")
+    except Exception as e:
+        # The claimed workspace is swept again once it is old enough
+        logger.error(f"Failed to recover leftovers in '{entry}', keeping them in '{claimed}': {str(e)}")
+    else:
+        shutil.rmtree(claimed, ignore_errors=True)
+
+    return recovered
+
+
+async def run_sweeper():
+    """
+    Sweep leftover files at startup and then every SWEEP_INTERVAL_SECONDS.
+    """
+    while True:
+        try:
+            recovered = await run_in_threadpool(sweep_leftover_files)
+            if recovered:
+                logger.info(f"Sweeper recovered {recovered} leftover files")
+        except Exception as e:
+            logger.error(f"Sweeper failed: {str(e)}")
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(run_sweeper())
+    yield
+    sweeper.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
 # Define the structure of the incoming JSON payload
 class FileEvent(BaseModel):
     EventName: str
@@ -56,33 +292,12 @@ async def retrieve_file(event: FileEvent):
     bucket_name = event.Records[0]["s3"]["bucket"]["name"]
     logger.debug(f"Extracted bucket_name: {bucket_name}, key: {key}")
 
-    # Define the temporary file path
     file_name = key.split("/")[-1]
-    file_path = os.path.join(UPLOAD_FOLDER, file_name)
-    logger.debug(f"Computed file_name: {file_name}, file_path: {file_path}")
-
-    # Download the file from MinIO
-    minio_client.download_file(bucket_name, file_name, file_path)
 
-    # Process the file and insert into CouchDB
+    # Download, parse and insert the file into CouchDB off the event loop
     try:
-        for filename in os.listdir(UPLOAD_FOLDER):
-            upload_folder_file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.isfile(
-                upload_folder_file_path
-            ):  # Ensure it's a file and not a directory
-                parsed_document = parse_document(file_path)
-                logger.info(f"Successfully parsed file '{file_name}'")
-                for i in parsed_document:
-
-                    couchdb_client.insert_document(CouchDb.db_name, i)
-                # If insertion is successful, remove the file
-                os.remove(upload_folder_file_path)
-                logger.info(
-                    f"Processed and removed file '{file_name}' from '{UPLOAD_FOLDER}'"
-                )
+        await run_in_threadpool(handle_new_file, bucket_name, key)
     except Exception as e:
-        # print(f"Failed to process the file '{upload_folder_file_path}: {e}")
         logger.error(f"Failed to process the file '{file_name}': {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Failed to process the file: {str(e)}"
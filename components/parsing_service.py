@@ -1,3 +1,5 @@
+import os
+import sys
 from cleantext import clean  # Meta Data Cleaning
 from pathlib import Path  # File type retrieval
 
@@ -5,21 +7,32 @@ from langchain_community.document_loaders import PyMuPDFLoader  # PDF
 from unstructured.partition.auto import partition  
 from unstructured.staging.base import convert_to_dict  #
 
+# Shared parsers package lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parsers import default_registry  # Parser backends shared with the indexer
+
 
 
 # Main Parsing Function
-def parse_document(file_path) -> list[dict]:
+def parse_document(file_path, workers=None) -> list[dict]:
     """
-    Parses a PDF, removes irrelevant metadata, and returns the cleaned text.
+    Parses a document, removes irrelevant metadata, and returns the cleaned
+    text.
 
     This function processes the document based on its file type, which is
     determined by the file extension, and follows these steps:
 
-    - For PDF files: Extracts the raw text from the PDF and removes irrelevant
-    metadata.
+    - Extracts the raw text of each page with the parser backend registered
+    for the file type (PyMuPDF for PDFs by default).
+    - Removes irrelevant metadata and cleans the extracted text.
 
     Args:
         file_path (str): The path to the document to be parsed.
+        workers (int, optional): Number of processes extracting PDF pages in
+        parallel. Defaults to PDF_EXTRACTION_WORKERS, or 1 (serial).
+
+    Raises:
+        ValueError: If no parser backend handles the file type.
 
     Returns:
         cleaned_data (list[dict]): A list of dictionaries containing the
@@ -29,11 +42,8 @@ def parse_document(file_path) -> list[dict]:
     # Get file extension
     file_type = get_file_extension(file_path)
 
-    # If file type is PDF, parse document. Currently only supports PDF.
-    if file_type == "pdf":
-        parsed_data = parse_with_PyMuPDF(file_path)
-    else:
-        raise ValueError(f"Unsupported file type: {file_type}")
+    # Parse with the backend chosen for the file type, raises ValueError if unsupported
+    parsed_data = parse_with_registry(file_path, workers)
 
     # Remove the irrelevant metadata and clean parsed text by removing '/n' etc
     cleaned_data = clean_metadata(parsed_data, file_type)
@@ -41,6 +51,39 @@ def parse_document(file_path) -> list[dict]:
     return cleaned_data
 
 
+def parse_with_registry(file_path, workers=None) -> list[dict]:
+    """
+    Parses a document with the backend the shared parser registry chooses for
+    its file type (PyMuPDF for PDFs by default, Unstructured for other
+    formats, overridable with PARSER_BACKENDS).
+
+    Args:
+        file_path (str): The path to the document to be parsed.
+        workers (int, optional): Number of processes extracting PDF pages in
+        parallel.
+
+    Returns:
+        list[dict]: A list of dictionaries, where each dictionary contains the
+        metadata and extracted text of a page of the document.
+
+    Raises:
+        ValueError: If no parser backend handles the file type.
+    """
+    pages = default_registry().parse(file_path, workers=workers)
+
+    return [
+        {
+            "metadata": {
+                "source": file_path,
+                "page": page["page_num"],
+                "total_pages": page["metadata"].get("total_pages"),
+            },
+            "page_content": page["text"],
+        }
+        for page in pages
+    ]
+
+
 def parse_with_PyMuPDF(file_path) -> list[dict]:
     """
     Parses a PDF document using PyMuPDF and returns extracted text data.
@@ -164,14 +207,14 @@ def clean_metadata(parsed_data, file_type) -> list[dict]:
             item.get("page_content"), lower=False, no_line_breaks=True
         )
 
-        if file_type == "pdf":
-            cleaned_item = {
-                "metadata": {
-                    "source": item.get("metadata").get("source"),
-                    "page": item.get("metadata").get("page"),
-                    "total_pages": item.get("metadata").get("total_pages"),
-                },
-                "page_content": cleaned_content,
-            }
+        # Every parser backend produces the same page metadata
+        cleaned_item = {
+            "metadata": {
+                "source": item.get("metadata").get("source"),
+                "page": item.get("metadata").get("page"),
+                "total_pages": item.get("metadata").get("total_pages"),
+            },
+            "page_content": cleaned_content,
+        }
         cleaned_data.append(cleaned_item)
     return cleaned_data
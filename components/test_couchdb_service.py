@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import uuid
+
+import pytest
+import requests
+
+os.environ.setdefault("COUCH_DB_ENDPOINT", "http://couchdb.test:5984")
+os.environ.setdefault("MINIO_URL", "http://minio.test:9000")
+os.environ.setdefault("COUCH_DB_MAX_RETRIES", "2")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import couchdb_service  # noqa: E402
+from couchdb_service import CouchDBClient, document_id  # noqa: E402
+
+
+class FakeCouchSession:
+    """
+    In-memory stand-in for the CouchDB endpoints used by CouchDBClient:
+    database HEAD/PUT, single document POST and `_bulk_docs`.
+
+    Args:
+        timeout_after_commit (int): Number of `_bulk_docs` requests that
+        store their documents and then fail with a read timeout.
+        reject (set): Document sources rejected by `_bulk_docs` with a
+        "forbidden" error, and by single inserts if `reject_single` is set.
+        reject_single (bool): Also reject the sources in `reject` when they
+        are inserted one at a time.
+    """
+
+    def __init__(self, timeout_after_commit=0, reject=(), reject_single=False):
+        self.docs = {}
+        self.databases = set()
+        self.timeout_after_commit = timeout_after_commit
+        self.reject = set(reject)
+        self.reject_single = reject_single
+        self.single_inserts = 0
+
+    @staticmethod
+    def _response(status_code, body=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body or {}).encode()
+        response.url = "http://couchdb.test"
+        return response
+
+    def head(self, url):
+        return self._response(200 if url.rsplit("/", 1)[-1] in self.databases else 404)
+
+    def put(self, url):
+        self.databases.add(url.rsplit("/", 1)[-1])
+        return self._response(201, {"ok": True})
+
+    def _store(self, doc):
+        doc_id = doc.get("_id") or uuid.uuid4().hex
+        if doc_id in self.docs:
+            return {"id": doc_id, "error": "conflict", "reason": "Document update conflict."}
+        self.docs[doc_id] = doc
+        return {"id": doc_id, "ok": True, "rev": "1-x"}
+
+    def post(self, url, json=None):
+        if url.endswith("/_bulk_docs"):
+            results = []
+            for doc in json["docs"]:
+                if doc["metadata"]["source"] in self.reject:
+                    results.append({"id": doc.get("_id"), "error": "forbidden", "reason": "rejected"})
+                else:
+                    results.append(self._store(doc))
+            if self.timeout_after_commit:
+                self.timeout_after_commit -= 1
+                raise requests.exceptions.ReadTimeout("read timed out")
+            return self._response(201, results)
+
+        self.single_inserts += 1
+        if self.reject_single and json["metadata"]["source"] in self.reject:
+            return self._response(403, {"error": "forbidden"})
+        result = self._store(json)
+        return self._response(409 if "error" in result else 201, result)
+
+
+def pages(source, count):
+    return [{"metadata": {"source": source, "page": page}, "page_content": f"page {page}"} for page in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # No backoff between the retries of a document
+    monkeypatch.setattr(couchdb_service.time, "sleep", lambda seconds: None)
+
+
+def test_timeout_after_commit_does_not_duplicate_pages():
+    session = FakeCouchSession(timeout_after_commit=1)
+    client = CouchDBClient(base_url="http://couchdb.test", session=session)
+
+    result = client.bulk_insert_documents("db", pages("./uploads/a.pdf", 5), batch_size=5)
+
+    # Every page is retried one at a time, conflicts with its committed copy and counts as inserted
+    assert result == {"inserted": 5, "failed": []}
+    assert session.single_inserts == 5
+    assert len(session.docs) == 5
+
+
+def test_rejected_pages_are_retried_individually():
+    session = FakeCouchSession(reject={"./uploads/b.pdf"})
+    client = CouchDBClient(base_url="http://couchdb.test", session=session)
+    docs = pages("./uploads/a.pdf", 3) + pages("./uploads/b.pdf", 2)
+
+    result = client.bulk_insert_documents("db", docs, batch_size=2)
+
+    assert result == {"inserted": 5, "failed": []}
+    assert session.single_inserts == 2
+    assert sorted(session.docs) == sorted(document_id(doc) for doc in docs)
+
+
+def test_pages_failing_their_retries_are_reported():
+    session = FakeCouchSession(reject={"./uploads/b.pdf"}, reject_single=True)
+    client = CouchDBClient(base_url="http://couchdb.test", session=session)
+    docs = pages("./uploads/a.pdf", 3) + pages("./uploads/b.pdf", 2)
+
+    result = client.bulk_insert_documents("db", docs)
+
+    assert result["inserted"] == 3
+    assert [failure["doc"]["metadata"]["source"] for failure in result["failed"]] == ["./uploads/b.pdf"] * 2
+    assert "403" in result["failed"][0]["error"]
+    assert len(session.docs) == 3
@@ -0,0 +1,9 @@
+from .parallel import extract_pages, page_count, split_page_range, PDF_BACKENDS
+from .registry import (
+    ParserBackend,
+    ParserRegistry,
+    PyMuPDFBackend,
+    PyPDF2Backend,
+    UnstructuredBackend,
+    default_registry,
+)
@@ -0,0 +1,130 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+
+PDF_BACKENDS = ("pymupdf", "pypdf2")
+
+
+def page_count(file_path: str, backend: str = "pymupdf") -> int:
+    """
+    Returns the number of pages of a PDF
+    """
+    if backend == "pymupdf":
+        import pymupdf
+        with pymupdf.open(file_path) as pdf:
+            return pdf.page_count
+
+    elif backend == "pypdf2":
+        import PyPDF2
+        with open(file_path, "rb") as f:
+            return len(PyPDF2.PdfReader(f).pages)
+
+    raise ValueError(f"Unsupported PDF backend: {backend}")
+
+
+def iter_page_range(file_path: str, backend: str, start: int, end: int) -> Iterator[str]:
+    """
+    Yields the text of pages [start, end) of a PDF one page at a time
+    """
+    if backend == "pymupdf":
+        import pymupdf
+        with pymupdf.open(file_path) as pdf:
+            for page_num in range(start, end):
+                yield pdf[page_num].get_text()
+
+    elif backend == "pypdf2":
+        import PyPDF2
+        with open(file_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            for page_num in range(start, end):
+                yield reader.pages[page_num].extract_text() or ""
+
+    else:
+        raise ValueError(f"Unsupported PDF backend: {backend}")
+
+
+def extract_page_range(file_path: str, backend: str, start: int, end: int) -> List[str]:
+    """
+    Extracts the text of pages [start, end) of a PDF. Runs in the worker processes.
+    """
+    return list(iter_page_range(file_path, backend, start, end))
+
+
+def split_page_range(total_pages: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits [0, total_pages) into up to `parts` contiguous ranges of near-equal size
+    """
+    parts = max(1, min(parts, total_pages))
+    size, remainder = divmod(total_pages, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return [(start, end) for start, end in ranges if end > start]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process pool for `workers` workers, shared by all extractions of the process
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return _pools[workers]
+
+
+def extraction_workers(workers: Optional[int] = None) -> int:
+    """
+    Number of extraction workers, from PDF_EXTRACTION_WORKERS if not given (defaults to 1, i.e. serial)
+    """
+    return workers or int(os.getenv("PDF_EXTRACTION_WORKERS") or 1)
+
+
+def extract_pages(file_path: str, backend: str = "pymupdf", workers: Optional[int] = None,
+                  pages_per_task: int = 8) -> Iterator[Tuple[int, str]]:
+    """Extracts the text of every page of a PDF, in page order.
+       With more than one worker the page range is split into tasks of `pages_per_task` pages
+       run on a process pool; at most two tasks per worker are in flight so results are
+       yielded as soon as they are ready without holding the whole document in memory.
+
+    Args:
+        file_path (str): Path to the PDF on the local disk
+        backend (str): "pymupdf" or "pypdf2"
+        workers (Optional[int], optional): Number of worker processes. Defaults to PDF_EXTRACTION_WORKERS or 1.
+        pages_per_task (int): Number of pages extracted per task
+
+    Yields:
+        Tuple[int, str]: Page number and text of the page
+    """
+    workers = extraction_workers(workers)
+    total_pages = page_count(file_path, backend)
+
+    if workers <= 1 or total_pages <= pages_per_task:
+        # Serially, pages are read one at a time as they are consumed
+        for page_num, text in enumerate(iter_page_range(file_path, backend, 0, total_pages)):
+            yield page_num, text
+        return
+
+    pool = get_extraction_pool(workers)
+    ranges = split_page_range(total_pages, max(workers, -(-total_pages // pages_per_task)))
+    pending = []
+    next_range = 0
+
+    while next_range < len(ranges) or pending:
+        while next_range < len(ranges) and len(pending) < 2 * workers:
+            start, end = ranges[next_range]
+            pending.append((start, pool.submit(extract_page_range, file_path, backend, start, end)))
+            next_range += 1
+
+        # Results are reassembled in page order
+        start, future = pending.pop(0)
+        for offset, text in enumerate(future.result()):
+            yield start + offset, text
@@ -0,0 +1,197 @@
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from .parallel import extract_pages, page_count
+
+
+class ParserBackend():
+
+    """Base class of the document parsers. A backend turns a local file into pages of text.
+
+    Each parsed page is a dict with the keys:
+        - page_num (int): Zero-based page number
+        - text (str): Extracted text of the page
+        - metadata (dict): Backend metadata of the page (e.g. total_pages)
+    """
+
+    name = None
+    extensions = ()
+    mime_types = ()
+
+    def parse(self, file_path: str, workers: Optional[int] = None) -> Iterator[dict]:
+        raise NotImplementedError
+
+
+class PyMuPDFBackend(ParserBackend):
+
+    """Fast PDF backend using PyMuPDF, with optional parallel page extraction."""
+
+    name = "pymupdf"
+    extensions = ("pdf",)
+    mime_types = ("application/pdf",)
+
+    def parse(self, file_path: str, workers: Optional[int] = None) -> Iterator[dict]:
+        total_pages = page_count(file_path, backend="pymupdf")
+        for page_num, text in extract_pages(file_path, backend="pymupdf", workers=workers):
+            yield {"page_num": page_num, "text": text, "metadata": {"total_pages": total_pages}}
+
+
+class PyPDF2Backend(ParserBackend):
+
+    """Pure Python PDF backend using PyPDF2, with optional parallel page extraction."""
+
+    name = "pypdf2"
+    extensions = ("pdf",)
+    mime_types = ("application/pdf",)
+
+    def parse(self, file_path: str, workers: Optional[int] = None) -> Iterator[dict]:
+        total_pages = page_count(file_path, backend="pypdf2")
+        for page_num, text in extract_pages(file_path, backend="pypdf2", workers=workers):
+            yield {"page_num": page_num, "text": text, "metadata": {"total_pages": total_pages}}
+
+
+class UnstructuredBackend(ParserBackend):
+
+    """Backend for every format Unstructured can partition (Office documents, HTML, e-mails, text...).
+       Elements are grouped into pages by their page number; formats without pages yield a single page."""
+
+    name = "unstructured"
+    extensions = ("pdf", "docx", "doc", "pptx", "ppt", "xlsx", "html", "htm", "txt", "md", "rtf", "odt", "eml", "msg", "epub")
+    mime_types = (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "application/vnd.ms-powerpoint",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "text/html",
+        "text/plain",
+        "text/markdown",
+        "application/rtf",
+        "application/vnd.oasis.opendocument.text",
+        "message/rfc822",
+        "application/vnd.ms-outlook",
+        "application/epub+zip",
+    )
+
+    def parse(self, file_path: str, workers: Optional[int] = None) -> Iterator[dict]:
+        from unstructured.partition.auto import partition
+
+        pages = OrderedDict()
+        for element in partition(filename=file_path):
+            page_number = getattr(element.metadata, "page_number", None) or 1
+            pages.setdefault(page_number - 1, []).append(element.text)
+
+        for page_num, texts in pages.items():
+            yield {"page_num": page_num, "text": "\n\n".join(texts), "metadata": {"total_pages": len(pages)}}
+
+
+class ParserRegistry():
+
+    """Registry of parser backends keyed by file extension and MIME type.
+       A MIME type, when given, takes precedence over the file extension.
+    """
+
+    def __init__(self):
+        self._backends: Dict[str, ParserBackend] = {}
+        self._by_extension: Dict[str, str] = {}
+        self._by_mime_type: Dict[str, str] = {}
+
+    def register(self, backend: ParserBackend, default: bool = True):
+        """
+        Registers a backend, making it the backend of its formats unless `default` is False
+        and another backend already handles them
+        """
+        self._backends[backend.name] = backend
+        for extension in backend.extensions:
+            if default or extension not in self._by_extension:
+                self._by_extension[extension] = backend.name
+        for mime_type in backend.mime_types:
+            if default or mime_type not in self._by_mime_type:
+                self._by_mime_type[mime_type] = backend.name
+
+    def set_backend(self, file_format: str, backend_name: str):
+        """
+        Chooses the backend for a format, given as an extension ("pdf") or a MIME type ("application/pdf")
+        """
+        if backend_name not in self._backends:
+            raise ValueError(f"Unknown parser backend: {backend_name}")
+
+        if "/" in file_format:
+            self._by_mime_type[file_format.lower()] = backend_name
+            # Keep the extensions of the MIME type consistent with it
+            for extension in mimetypes.guess_all_extensions(file_format):
+                self._by_extension[extension.lstrip(".")] = backend_name
+        else:
+            self._by_extension[file_format.lower().lstrip(".")] = backend_name
+
+    def get_backend(self, file_path: str, mime_type: Optional[str] = None) -> ParserBackend:
+        """
+        Returns the backend for a file
+
+        Raises:
+            ValueError: If no backend handles the file type
+        """
+        if mime_type:
+            mime_type = mime_type.split(";")[0].strip().lower()
+            if mime_type in self._by_mime_type:
+                return self._backends[self._by_mime_type[mime_type]]
+
+        extension = Path(file_path).suffix.lower().lstrip(".")
+        if extension in self._by_extension:
+            return self._backends[self._by_extension[extension]]
+
+        guessed_type, _ = mimetypes.guess_type(file_path)
+        if guessed_type in self._by_mime_type:
+            return self._backends[self._by_mime_type[guessed_type]]
+
+        raise ValueError(f"Unsupported file type: {extension or mime_type}")
+
+    def supports(self, file_path: str, mime_type: Optional[str] = None) -> bool:
+        try:
+            self.get_backend(file_path, mime_type)
+            return True
+        except ValueError:
+            return False
+
+    def parse(self, file_path: str, mime_type: Optional[str] = None, workers: Optional[int] = None) -> Iterator[dict]:
+        """
+        Parses a local file into pages with the backend chosen for its format
+        """
+        return self.get_backend(file_path, mime_type).parse(file_path, workers=workers)
+
+    def formats(self) -> dict:
+        """
+        Returns the backend chosen for every extension and MIME type
+        """
+        return {"extensions": dict(self._by_extension), "mime_types": dict(self._by_mime_type)}
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def default_registry() -> ParserRegistry:
+    """Returns the process-wide registry: PyMuPDF for PDFs, Unstructured for every other format,
+       PyPDF2 available on request. Deployments choose per format with PARSER_BACKENDS, e.g.
+       PARSER_BACKENDS="pdf=pypdf2,docx=unstructured,text/html=unstructured".
+    """
+    global _default_registry
+
+    with _default_registry_lock:
+        if _default_registry is None:
+            registry = ParserRegistry()
+            registry.register(PyMuPDFBackend())
+            registry.register(PyPDF2Backend(), default=False)
+            registry.register(UnstructuredBackend(), default=False)
+
+            for setting in filter(None, (os.getenv("PARSER_BACKENDS") or "").split(",")):
+                file_format, backend_name = setting.split("=", 1)
+                registry.set_backend(file_format.strip(), backend_name.strip())
+
+            _default_registry = registry
+
+        return _default_registry